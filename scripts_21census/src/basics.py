@@ -1,4 +1,14 @@
-from pandas import DataFrame
+import numpy as np
+from pandas import DataFrame, Index
+
+
+def encode_codes(values, categories):
+    """Map category codes to their positions (0..k-1) in the categorizing, as an integer array"""
+    positions = Index(list(categories)).get_indexer(values)
+    if (positions < 0).any():
+        unknown = sorted(set(np.asarray(values)[positions < 0].tolist()))
+        raise ValueError("Codes %s are not in the categorizing %s" % (unknown, list(categories)))
+    return positions.astype(np.intp)
 
 
 class Demographics:
@@ -27,6 +37,9 @@ class Constraints(Demographics):
         super(Constraints, self).__init__(var_code_cate)
         self.var_marg_dist = var_marg_dist
         self._check_categorizing()
+        # memoized views of var_marg_dist, which is not expected to change after construction
+        self._marginals = None
+        self._var_marg_dist_by_cate = None
 
     def select(self, variables):
         """only keep info of selected variables"""
@@ -38,23 +51,47 @@ class Constraints(Demographics):
             if len(self.var_code_cate[var]) != len(self.var_marg_dist[var]):
                 raise ValueError("The distribution structure of %s does not match with its categorizing" % var)
 
+    def marginals(self):
+        """Marginal distribution of every variable as a read-only array, in categorizing order"""
+        if self._marginals is None:
+            self._marginals = {}
+            for var in self.variables:
+                totals = np.array([self.var_marg_dist[var][code] for code in self.var_code_cate[var]], dtype=float)
+                totals.flags.writeable = False
+                self._marginals[var] = totals
+        return self._marginals
+
     @property
     def var_marg_dist_by_cate(self):
-        dist = {}
-        for var in self.variables:
-            dist[var] = {self.var_code_cate[var][code]: round(self.var_marg_dist[var][code], 2) for code in
-                         self.var_code_cate[var]}
-        return dist
+        if self._var_marg_dist_by_cate is None:
+            dist = {}
+            for var in self.variables:
+                dist[var] = {self.var_code_cate[var][code]: round(self.var_marg_dist[var][code], 2) for code in
+                             self.var_code_cate[var]}
+            self._var_marg_dist_by_cate = dist
+        return self._var_marg_dist_by_cate
 
 
 class Population:
-    """Population in tabular form"""
+    """Population in tabular form
+
+    Marginals are computed once and cached; changing weights or records through set_weights,
+    normalize_weights, recode_variable or by assigning records drops the cache, and so does assigning a new
+    weights column (records["weights"] = w), which is caught by the identity of the column's array. After editing
+    values in place (e.g. through records.loc) or the variable columns of records, call invalidate_marginals.
+    """
 
     def __init__(self, demographics: Demographics, records, weights=None):
+        self._marginals = None
+        self._marginal_dist = None
+        self._marginal_weights = None
         self.demographics = demographics
 
         # the variable(column) order of record should be the same as the variable in demographics
-        self.records = DataFrame(records, columns=demographics.variables)
+        if isinstance(records, DataFrame) and list(records.columns) == list(demographics.variables):
+            self.records = records.copy(deep=False)     # shares the column data until either side writes
+        else:
+            self.records = DataFrame(records, columns=demographics.variables)
 
         if weights is not None:
             if len(weights) == len(self.records):
@@ -64,32 +101,85 @@ class Population:
         else:
             self.records["weights"] = 1 / len(self.records)
 
+    @property
+    def records(self):
+        return self._records
+
+    @records.setter
+    def records(self, records):
+        self._records = records
+        self.invalidate_marginals()
+
+    def invalidate_marginals(self):
+        """Drop the cached marginals"""
+        self._marginals = None
+        self._marginal_dist = None
+        self._marginal_weights = None
+
+    def _check_marginals(self):
+        """Drop the cached marginals if the weights column was replaced since they were computed"""
+        if self._marginal_weights is not None and not _same_array(self._marginal_weights,
+                                                                  self._records["weights"].to_numpy()):
+            self.invalidate_marginals()
+
+    def set_weights(self, weights):
+        """Replace the weights of all records"""
+        if len(weights) != len(self.records):
+            raise ValueError("The length of weights must equal to the length of records")
+        self.records["weights"] = weights
+        self.invalidate_marginals()
+
     def normalize_weights(self, total_weight=1):
         """Normalize weights so that the sum of all record's weights equals to 1"""
-        self.records["weights"] /= sum(self.records["weights"])
+        self._check_marginals()
+        weight_sum = sum(self.records["weights"])
+        self.records["weights"] /= weight_sum
         self.records["weights"] *= total_weight
+        scale = total_weight / weight_sum
+
+        # cached totals scale with the weights; only the rounded display form is recomputed
+        if self._marginals is not None:
+            totals, present = self._marginals
+            self._marginals = ({var: _read_only(var_totals * scale) for var, var_totals in totals.items()}, present)
+            self._marginal_weights = self.records["weights"].to_numpy()
+        self._marginal_dist = None
 
     def aggregate(self):
         """Generate aggregate-form population"""
         columns = list(self.records.columns)
         columns.remove("weights")
-        cate_weights = self.records.groupby(by=columns)["weights"].sum()
+        type_index = PersonTypeIndex(self.demographics.select(columns))
+        type_keys, inverse = np.unique(type_index.encode(self.records), return_inverse=True)
+        weights = np.bincount(inverse, weights=self.records["weights"].to_numpy(), minlength=len(type_keys))
 
         return Population(self.demographics,
-                          records=cate_weights.index.to_frame(index=False),
-                          weights=cate_weights.to_list())
-
-    def recode_variable(self, new_var_code_cate: dict, var_recode_map: dict):
-        """Recode variable or reduce variable categories"""
-        for var in var_recode_map:
-            code_cate_convert_map = var_recode_map[var]
-            for new_code in code_cate_convert_map:
-                old_codes = code_cate_convert_map[new_code]
-                self.records[var] = self.records[var].apply(
-                    lambda old_code: new_code if old_code in old_codes else old_code)
+                          records=type_index.decode(type_keys),
+                          weights=weights.tolist())
+
+    def recode_variable(self, new_var_code_cate: dict, var_recode_map: dict = None, compiled_recode_map: dict = None):
+        """Recode variable or reduce variable categories
+
+        Every variable is recoded in one indexing pass through the lookup array of compile_recode_map;
+        a code missing from the map raises a ValueError instead of being kept as is. A map used repeatedly can be
+        compiled once and passed as compiled_recode_map instead of var_recode_map.
+        """
+        if (var_recode_map is None) == (compiled_recode_map is None):
+            raise ValueError("Give exactly one of var_recode_map and compiled_recode_map")
+        if compiled_recode_map is None:
+            compiled_recode_map = compile_recode_map(var_recode_map)
+
+        for var, (offset, lookup) in compiled_recode_map.items():
+            old_codes = self.records[var].to_numpy(dtype=np.int64) - offset
+            unknown = (old_codes < 0) | (old_codes >= len(lookup))
+            unknown[~unknown] = lookup[old_codes[~unknown]] == RECODE_UNMAPPED
+            if unknown.any():
+                raise ValueError("Codes %s of variable %s are not in the recode map"
+                                 % (sorted(set((old_codes[unknown] + offset).tolist())), var))
+            self.records[var] = lookup[old_codes]
 
         for var in new_var_code_cate:
             self.demographics.var_code_cate[var] = new_var_code_cate[var]
+        self.invalidate_marginals()
 
     def select(self, variables):
         """Generate a mew population with only selected attributes/variables"""
@@ -101,13 +191,241 @@ class Population:
     def variables(self):
         return self.demographics.variables
 
+    def _marginal_arrays(self):
+        """Cached (totals, present): weight totals and whether any record falls in each category, per variable"""
+        self._check_marginals()
+        if self._marginals is None:
+            self._marginal_weights = self.records["weights"].to_numpy()
+            weights = self._marginal_weights.astype(float, copy=False)
+            totals, present = {}, {}
+            for var in self.variables:
+                categories = list(self.demographics.var_code_cate[var])
+                codes = encode_codes(self.records[var], categories)
+                totals[var] = _read_only(np.bincount(codes, weights=weights, minlength=len(categories)))
+                present[var] = _read_only(np.bincount(codes, minlength=len(categories)) > 0)
+            self._marginals = (totals, present)
+        return self._marginals
+
+    def marginals(self):
+        """Weight total of every category as a read-only array per variable, in categorizing order"""
+        return self._marginal_arrays()[0]
+
+    @property
+    def marginal_dist(self):
+        self._check_marginals()
+        if self._marginal_dist is None:
+            totals, present = self._marginal_arrays()
+            dist = {}
+            for var in self.demographics.variables:
+                cate_names = self.demographics.var_code_cate[var].values()
+                dist[var] = {cate_name: round(float(total), 2)
+                             for cate_name, total, has_records in zip(cate_names, totals[var], present[var])
+                             if has_records}
+            self._marginal_dist = dist
+        return self._marginal_dist
+
+
+def _same_array(a, b):
+    """Whether two arrays view the same data, without comparing their values"""
+    return a.__array_interface__['data'][0] == b.__array_interface__['data'][0] and a.shape == b.shape
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+def code_dtype(n_categories):
+    """Smallest unsigned integer type holding the positions of n_categories categories"""
+    return np.min_scalar_type(max(n_categories - 1, 0))
+
+
+# lookup entry of the old codes that a recode map leaves out
+RECODE_UNMAPPED = np.iinfo(np.int64).min
+
+
+def compile_recode_map(var_recode_map: dict):
+    """
+    Turn a recode map ({var: {new_code: [old_code, ...]}}) into lookup arrays over integer codes.
+
+    Returns:
+        dict: Maps every variable to (offset, lookup), so that the new code of old_code is lookup[old_code - offset];
+              old codes left out of the map hold RECODE_UNMAPPED. Lookups are read-only, so the result can be
+              shared, e.g. as a module constant.
+
+    Raises:
+        ValueError: If an old code is mapped to more than one new code.
+    """
+    compiled = {}
+    for var, code_cate_convert_map in var_recode_map.items():
+        pairs = [(int(old_code), int(new_code))
+                 for new_code, old_codes in code_cate_convert_map.items() for old_code in old_codes]
+        old_codes = [old_code for old_code, _ in pairs]
+        if len(set(old_codes)) != len(old_codes):
+            raise ValueError("Variable %s maps an old code to more than one new code" % var)
+
+        offset = min(old_codes, default=0)
+        lookup = np.full(max(old_codes, default=-1) - offset + 1, RECODE_UNMAPPED, dtype=np.int64)
+        for old_code, new_code in pairs:
+            lookup[old_code - offset] = new_code
+        compiled[var] = (offset, _read_only(lookup))
+    return compiled
+
+
+class ArrayPopulation:
+    """Population in columnar form: one small-int array of category positions per variable and a weights array
+
+    Positions index the categories of demographics.var_code_cate[var] in order, so each variable takes the
+    smallest unsigned integer type allowed by Demographics.shape. Selecting variables shares the arrays;
+    conversion to and from the DataFrame-backed Population happens at the edges.
+    """
+
+    __slots__ = ("demographics", "codes", "weights")
+
+    def __init__(self, demographics: Demographics, codes: dict, weights=None, weights_dtype=np.float64):
+        self.demographics = demographics
+        self.codes = {}
+        for var, n_categories in zip(demographics.variables, demographics.shape):
+            var_codes = np.asarray(codes[var])
+            if var_codes.dtype != code_dtype(n_categories):
+                var_codes = var_codes.astype(code_dtype(n_categories))
+            self.codes[var] = var_codes
+
+        n_records = len(self.codes[demographics.variables[0]]) if demographics.variables else 0
+        if weights is not None:
+            if len(weights) != n_records:
+                raise ValueError("The length of weights must equal to the length of records")
+            self.weights = np.asarray(weights, dtype=weights_dtype)
+        else:
+            self.weights = np.full(n_records, 1 / n_records, dtype=weights_dtype)
+
+    @classmethod
+    def from_population(cls, population: Population, weights_dtype=np.float64):
+        """Encode a DataFrame-backed Population"""
+        demographics = population.demographics
+        codes = {var: encode_codes(population.records[var], list(demographics.var_code_cate[var]))
+                 for var in demographics.variables}
+        return cls(demographics, codes, weights=population.records["weights"].to_numpy(), weights_dtype=weights_dtype)
+
+    def to_frame(self):
+        """Records in DataFrame form (category codes and a weights column), as held by Population"""
+        records = DataFrame({var: np.asarray(list(self.demographics.var_code_cate[var]))[self.codes[var]]
+                             for var in self.demographics.variables})
+        records["weights"] = self.weights
+        return records
+
+    def to_population(self):
+        """Decode into a DataFrame-backed Population"""
+        records = self.to_frame()
+        return Population(self.demographics, records[list(self.demographics.variables)], weights=records["weights"])
+
+    def __len__(self):
+        return len(self.weights)
+
+    @property
+    def variables(self):
+        return self.demographics.variables
+
+    def select(self, variables):
+        """Population with only the selected variables, sharing the code and weight arrays"""
+        return ArrayPopulation(self.demographics.select(variables), {var: self.codes[var] for var in variables},
+                               weights=self.weights, weights_dtype=self.weights.dtype)
+
+    def take(self, index):
+        """Population with the given records; a slice gives views, an index array gives copies"""
+        return ArrayPopulation(self.demographics, {var: codes[index] for var, codes in self.codes.items()},
+                               weights=self.weights[index], weights_dtype=self.weights.dtype)
+
+    def normalize_weights(self, total_weight=1):
+        """Normalize weights in place so that the sum of all record's weights equals to total_weight"""
+        self.weights *= total_weight / self.weights.sum()
+
+    def aggregate(self):
+        """Generate aggregate-form population: one record per distinct person-type, with summed weights"""
+        shape = self.demographics.shape
+        keys = np.ravel_multi_index([self.codes[var] for var in self.variables], shape)
+        type_keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=self.weights, minlength=len(type_keys))
+        codes = dict(zip(self.variables, np.unravel_index(type_keys, shape)))
+        return ArrayPopulation(self.demographics, codes, weights=weights, weights_dtype=self.weights.dtype)
+
+    def marginals(self):
+        """Weight total of every category, as one array per variable"""
+        return {var: np.bincount(self.codes[var], weights=self.weights, minlength=n_categories)
+                for var, n_categories in zip(self.variables, self.demographics.shape)}
+
     @property
     def marginal_dist(self):
         dist = {}
-        for var in self.demographics.variables:
-            weights_by_code = self.records.groupby(var)["weights"].sum()
-            weights_by_code = weights_by_code.to_dict()
-            weights_by_cate_name = {self.demographics.var_code_cate[var][code]: round(weights_by_code[code], 2) for code
-                                    in weights_by_code}
-            dist[var] = weights_by_cate_name
-        return dist
\ No newline at end of file
+        for var, totals in self.marginals().items():
+            dist[var] = {cate: round(float(total), 2)
+                         for cate, total in zip(self.demographics.var_code_cate[var].values(), totals) if total > 0}
+        return dist
+
+
+class PersonTypeIndex:
+    """
+    Person-type keys: every combination of categories encoded as one integer in mixed radix.
+
+    The radices are Demographics.shape, the last variable varies fastest, so key order follows the order of the
+    categorizing. Type-level tables (weights, fuzzy outputs ...) become arrays of length size, looked up with
+    plain indexing (table[keys]) instead of multi-column merges.
+    """
+
+    def __init__(self, demographics: Demographics):
+        self.demographics = demographics
+        self.categories = [list(demographics.var_code_cate[var]) for var in demographics.variables]
+
+    @property
+    def variables(self):
+        return self.demographics.variables
+
+    @property
+    def shape(self):
+        return self.demographics.shape
+
+    @property
+    def size(self):
+        """Number of person-types"""
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def encode(self, records, columns=None):
+        """
+        Keys of the records' person-types.
+
+        Parameters:
+            records (DataFrame or dict): Category codes of each variable.
+            columns (list or None): Column of each variable in records, if named differently.
+
+        Returns:
+            np.ndarray: One int64 key per record.
+        """
+        columns = columns or self.variables
+        if len(columns) != len(self.variables):
+            raise ValueError("Expected one column for each of the variables %s" % (self.variables,))
+        positions = [encode_codes(np.asarray(records[column]), categories)
+                     for column, categories in zip(columns, self.categories)]
+        return np.ravel_multi_index(positions, self.shape).astype(np.int64)
+
+    def decode(self, keys, columns=None):
+        """Category codes of the person-types of keys, as a DataFrame with one column per variable"""
+        columns = columns or self.variables
+        positions = np.unravel_index(np.asarray(keys, dtype=np.int64), self.shape)
+        return DataFrame({column: np.asarray(categories)[position]
+                          for column, categories, position in zip(columns, self.categories, positions)})
+
+    def table(self, keys, values, fill_value=np.nan):
+        """
+        Dense type-level table: values placed at their person-type keys, fill_value elsewhere.
+
+        values may have extra dimensions (e.g. one distribution per type); lists held in an object column
+        stay objects. Look the table up with table[keys].
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(np.unique(keys)) != len(keys):
+            raise ValueError("Person-type keys of a table must be unique")
+        values = np.asarray(values)
+        table = np.full((self.size,) + values.shape[1:], fill_value,
+                        dtype=np.result_type(values.dtype, np.min_scalar_type(fill_value)))
+        table[keys] = values
+        return table
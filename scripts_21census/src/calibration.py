@@ -0,0 +1,239 @@
+"""
+Calibration of the fuzzy rule sets against the Statista targets, without generating any orders.
+
+A candidate is a set of parameters (membership function points, rule weights ...) turned into the three rule
+sets by a build_rules function. Each candidate is scored on the person-type table with vectorized inference:
+the category and frequency mixes implied by the rules for every Statista group (total, female, male, 18-29,
+30-49, 50+) and the implied order category mix are compared with category_statista.xlsx,
+frequency_statista.xlsx and verify_order_category.xlsx by Jensen-Shannon distance.
+
+Candidates run in a process pool; the person types, targets and build_rules are sent once to each worker.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from itertools import product
+import multiprocessing
+import pickle
+import numpy as np
+import pandas as pd
+from skfuzzy import control as ctrl
+from tqdm import tqdm
+
+from .config import DATA_ECB, RES_STATIC
+from .fuzzy_inference import BatchMamdani, MultiOutputMamdani, freq_table
+from .validation import get_js_distance
+
+# persons of every Statista group, as codes of the simplified census variables; total is everyone
+STATISTA_GROUPS = {
+    'total': {},
+    'female': {'sex': 0},
+    'male': {'sex': 1},
+    '18-29': {'age': 1},
+    '30-49': {'age': 2},
+    '50+': {'age': 3},
+}
+
+# groups (columns) every target table must have; the frequency table has no total column
+STATISTA_TARGET_GROUPS = {
+    'category': list(STATISTA_GROUPS),
+    'frequency': [group for group in STATISTA_GROUPS if group != 'total'],
+}
+
+# distances reported for every candidate, see score_mixes
+SCORE_COLUMNS = ['category', 'frequency', 'order_category', 'score']
+
+# person types, targets and build_rules of the current worker process, set by _init_worker
+_worker_context = None
+
+
+def _check_groups(columns, groups, source):
+    """The groups, after checking that every one of them is a column of source"""
+    missing = [group for group in groups if group not in columns]
+    if missing:
+        raise ValueError("Groups %s are missing in %s, which has columns %s" % (missing, source, list(columns)))
+    return list(groups)
+
+
+def load_statista_targets(category_file=DATA_ECB / 'category_statista.xlsx',
+                          frequency_file=DATA_ECB / 'frequency_statista.xlsx',
+                          order_category_file=RES_STATIC / 'verify_order_category.xlsx'):
+    """
+    Read the calibration targets as distributions.
+
+    Returns:
+        dict: 'category' (categories x groups) and 'frequency' (frequency classes x groups) DataFrames, each
+              column normalized to sum 1, and 'order_category', the order category distribution (Series).
+    """
+    category = pd.read_excel(category_file, sheet_name='data', index_col='cate_id')
+    frequency = pd.read_excel(frequency_file, sheet_name='data', index_col='cate_id')
+    order_category = pd.read_excel(order_category_file, sheet_name='data')['Probability']
+
+    category = category[_check_groups(category.columns, STATISTA_TARGET_GROUPS['category'], category_file)]
+    frequency = frequency[_check_groups(frequency.columns, STATISTA_TARGET_GROUPS['frequency'], frequency_file)]
+    return {'category': category / category.sum(), 'frequency': frequency / frequency.sum(),
+            'order_category': order_category / order_category.sum()}
+
+
+def implied_mixes(person_types, avail_prob, freq_dist, freq_e, cate_dist, weights=None):
+    """
+    Category and frequency mixes implied by the inference results, without sampling any order.
+
+    Every person type counts with its weight (e.g. its number of persons; 1 by default) times its availability,
+    so the mixes are those of online shoppers; the order category mix also weights by the expected frequency.
+
+    Returns:
+        dict: 'category' (categories x groups) and 'frequency' (frequency classes x groups) DataFrames and the
+              'order_category' Series, each normalized to sum 1.
+    """
+    weights = np.ones(len(person_types)) if weights is None else np.asarray(weights, dtype=float)
+    shoppers = weights * np.asarray(avail_prob, dtype=float)
+    freq_dist, cate_dist = np.asarray(freq_dist, dtype=float), np.asarray(cate_dist, dtype=float)
+
+    category, frequency = {}, {}
+    for group, codes in STATISTA_GROUPS.items():
+        in_group = np.ones(len(person_types), dtype=bool)
+        for var, code in codes.items():
+            in_group &= np.asarray(person_types[var]) == code
+        category[group] = shoppers[in_group] @ cate_dist[in_group]
+        frequency[group] = shoppers[in_group] @ freq_dist[in_group]
+
+    category, frequency = pd.DataFrame(category), pd.DataFrame(frequency)
+    order_category = pd.Series((shoppers * np.asarray(freq_e, dtype=float)) @ cate_dist)
+    return {'category': category / category.sum(), 'frequency': frequency / frequency.sum(),
+            'order_category': order_category / order_category.sum()}
+
+
+def score_mixes(mixes, targets):
+    """
+    Jensen-Shannon distance of the implied mixes to the targets, averaged over the groups of each target.
+
+    Returns:
+        dict: Distance of 'category', 'frequency' and 'order_category', and 'score', their mean.
+    """
+    scores = {}
+    for target in ['category', 'frequency']:
+        groups = _check_groups(mixes[target].columns, list(targets[target].columns), "the implied %s mixes" % target)
+        scores[target] = np.mean([get_js_distance(mixes[target][group].to_numpy(), targets[target][group].to_numpy())
+                                  for group in groups])
+    scores['order_category'] = get_js_distance(mixes['order_category'].to_numpy(),
+                                               targets['order_category'].to_numpy())
+    scores['score'] = np.mean([scores['category'], scores['frequency'], scores['order_category']])
+    return scores
+
+
+def evaluate_rules(rules_availability, rules_per_frequency, rules_per_product, person_types, targets,
+                   time_window='Orders_per_week', weights=None):
+    """Score one parameterisation of the rule sets on the person types, see score_mixes"""
+    avail_prob = BatchMamdani(rules_availability).compute(person_types) / 100
+    if np.isnan(avail_prob).any():
+        raise ValueError("No availability rule fires for some person types")
+    freq_dist, freq_e = MultiOutputMamdani(rules_per_frequency).predict(person_types, freq_table[time_window])
+    cate_dist, _ = MultiOutputMamdani(rules_per_product).predict(person_types)
+    return score_mixes(implied_mixes(person_types, avail_prob, freq_dist, freq_e, cate_dist, weights), targets)
+
+
+def with_rule_weights(rules, rule_weights: dict):
+    """
+    Copy of a rule list where the consequents of some rules get new weights.
+
+    Parameters:
+        rules (list): Rules, e.g. rules_per_product['product_2'].
+        rule_weights (dict): Maps a rule's position in rules to the weight of its consequents.
+    """
+    return [ctrl.Rule(rule.antecedent, [c.term % rule_weights[i] for c in rule.consequent],
+                      and_func=rule.and_func, or_func=rule.or_func)
+            if i in rule_weights else rule for i, rule in enumerate(rules)]
+
+
+def candidate_grid(**param_values):
+    """Every combination of the given parameter values, as a list of keyword dicts for build_rules"""
+    names = list(param_values)
+    return [dict(zip(names, values)) for values in product(*param_values.values())]
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _evaluate_candidate(position, params, context=None):
+    """Score one candidate in the current process; errors are returned, not raised, so one cannot stop the run"""
+    build_rules, person_types, targets, time_window, weights = context or _worker_context
+    try:
+        return position, evaluate_rules(*build_rules(**params), person_types, targets, time_window, weights), None
+    except Exception as e:
+        return position, None, "%s: %s" % (type(e).__name__, e)
+
+
+def _check_picklable(context):
+    """Raise a ValueError naming the problem if the calibration context cannot reach worker processes"""
+    build_rules = context[0]
+    try:
+        pickle.dumps(context)
+    except Exception as e:
+        raise ValueError("build_rules, the person types and the targets must be picklable to run in worker "
+                         "processes (%s: %s); pass max_workers=1 to run in this process" % (type(e).__name__, e))
+    if getattr(build_rules, '__module__', None) == '__main__' and multiprocessing.get_start_method() != 'fork':
+        raise ValueError("build_rules is defined in __main__ (e.g. a notebook), which %s-started worker processes "
+                         "cannot import; define it in a module or pass max_workers=1"
+                         % multiprocessing.get_start_method())
+
+
+def calibrate(build_rules, candidates, person_types, targets=None, time_window='Orders_per_week', weights=None,
+              max_workers=None, show_progress=True):
+    """
+    Score every candidate parameterisation of the rule sets in a process pool.
+
+    Parameters:
+        build_rules (callable): build_rules(**params) returns (rules_availability, rules_per_frequency,
+                                rules_per_product). It is sent to the worker processes, so unless max_workers
+                                is 1 it must be picklable, and defined in a module where processes are spawned
+                                (Windows, macOS): functions of a notebook cannot be sent there.
+        candidates (list): Keyword dicts of build_rules, e.g. from candidate_grid.
+        person_types (DataFrame): One row per person type, with a column per antecedent (e.g. SYN_POP_type).
+        targets (dict or None): Targets as returned by load_statista_targets; None loads them.
+        time_window (str): Column of freq_table the frequency expectation is given in.
+        weights (array-like or None): Weight of every person type, e.g. its number of persons; None weights all 1.
+        max_workers (int or None): Number of worker processes; 1 runs in the current process.
+        show_progress (bool): Show a progress bar.
+
+    Returns:
+        DataFrame: One row per candidate with its parameters, its distances ('category', 'frequency',
+                   'order_category', 'score') and 'failure' (the error message of failed candidates),
+                   sorted by score, best first.
+
+    Raises:
+        ValueError: If build_rules, the person types or the targets cannot be sent to worker processes.
+        RuntimeError: If the worker processes stop (e.g. are killed) before every candidate is scored.
+    """
+    targets = load_statista_targets() if targets is None else targets
+    context = (build_rules, person_types, targets, time_window, weights)
+
+    if max_workers == 1:
+        results = (_evaluate_candidate(position, params, context) for position, params in enumerate(candidates))
+        results = list(tqdm(results, desc='Calibrating', total=len(candidates), disable=not show_progress))
+    else:
+        _check_picklable(context)
+        results = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(context,)) as executor:
+            futures = {executor.submit(_evaluate_candidate, position, params): position
+                       for position, params in enumerate(candidates)}
+            try:
+                for future in tqdm(as_completed(futures), desc='Calibrating', total=len(candidates),
+                                   disable=not show_progress):
+                    try:
+                        results.append(future.result())
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:      # the candidate's parameters could not be sent to a worker
+                        results.append((futures[future], None, "%s: %s" % (type(e).__name__, e)))
+            except BrokenProcessPool as e:
+                raise RuntimeError("The calibration worker processes stopped after %d of %d candidates; run with "
+                                   "max_workers=1 to see the error" % (len(results), len(candidates))) from e
+
+    rows = [None] * len(candidates)
+    for position, scores, failure in results:
+        rows[position] = {**candidates[position], **(scores or dict.fromkeys(SCORE_COLUMNS, np.nan)),
+                          'failure': failure}
+    return pd.DataFrame(rows).sort_values('score', na_position='last', ignore_index=True)
@@ -1,5 +1,10 @@
-from src.basics import Demographics, Constraints, Population
+from src.basics import Demographics, Constraints, Population, compile_recode_map
+import copy
+import hashlib
+import json
+import os
 import random
+from collections.abc import Mapping
 from itertools import product
 from pathlib import Path
 import pandas as pd
@@ -15,6 +20,7 @@ REPO_PATH       = SCRIPT_PATH.parent                        # current repository
 DATA_PATH       = REPO_PATH / "data"                        # path for saving the data
 DATA_21_PATH    = REPO_PATH / 'data' / '2021-census-data'   # path for all census data related files
 SRC_PATH        = REPO_PATH / "scripts_21census" / 'src'
+CACHE_PATH      = SCRIPT_PATH / 'cache'                     # path for cached intermediate files
 
 
 VAR_RENAME_CENSUS_2021 = {
@@ -159,6 +165,16 @@ VAR_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED = {
     "approximated_social_grade": {0: [1, ], 1: [2, ], 2: [3, ], 3: [4, ]},
 }
 
+# lookup arrays of the recode map, compiled once for every base population built
+COMPILED_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED = compile_recode_map(VAR_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED)
+
+# columns of the census microdata filled from their value distribution, and their missing-value code
+CENSUS_2021_FILL_COLUMNS = ["approximated_social_grade", "economic_activity", "english_proficiency", "ethnic_group",
+                            "employment_status",    # employment_status over 25% missing
+                            "highest_qualification", "marital_status", "number_of_cars_and_vans", ]
+CENSUS_2021_NA_VALUE = -8
+CENSUS_2021_FILL_SEED = 100
+
 def fillna_column(file, column, na_value, random_seed=100):
     """Fill missing values in a column based on the distribution of existing values."""
     if random_seed is not None:
@@ -172,34 +188,204 @@ def fillna_column(file, column, na_value, random_seed=100):
     return file
 
 
-def get_census_2021_base_population(microdata_path: Path = DATA_21_PATH / 'census_microdata_2021_inner_london.csv', simplified=True) -> Population:
-    """Get base population from census 2021 microdata(csv file): load, rename variables, fill missing and simplify categories.""" 
+
+def impute_missing(file, columns, na_value=-8, random_seed=100, by=None):
+    """
+    Fill missing values in several columns at once, each drawn from the distribution of the column's existing values.
+
+    Every column draws from its own np.random.Generator, spawned from np.random.SeedSequence(random_seed) in the
+    order of columns, so the result does not depend on the global random state or on the process running it.
+
+    Parameters:
+        file (DataFrame): Records, filled in place.
+        columns (list): Columns to fill.
+        na_value: Code of missing values.
+        random_seed (int): Root seed of the column streams.
+        by (str or list or None): Column(s) to condition on, e.g. 'borough_code': missing values are drawn from the
+                                  existing values within the same group. Groups without any existing value draw
+                                  from the whole column.
+
+    Returns:
+        DataFrame: file, with missing values filled.
+    """
+    if by is None:
+        group_ids, n_groups = np.zeros(len(file), dtype=np.intp), 1
+    else:
+        group_ids = file.groupby([by] if isinstance(by, str) else list(by), sort=False, dropna=False).ngroup()
+        group_ids = group_ids.to_numpy(dtype=np.intp)
+        n_groups = int(group_ids.max()) + 1 if len(group_ids) else 1
+
+    missing = file[columns].to_numpy() == na_value
+    column_rngs = [np.random.default_rng(seed) for seed in np.random.SeedSequence(random_seed).spawn(len(columns))]
+
+    for j, (column, rng) in enumerate(zip(columns, column_rngs)):
+        column_missing = missing[:, j]
+        if not column_missing.any():
+            continue
+        values = file[column].to_numpy()
+        existing_codes, existing_values = pd.factorize(values[~column_missing], sort=True)
+        if len(existing_values) == 0:
+            raise ValueError("Column %s has no existing values to impute from" % column)
+
+        # counts of every existing value in every group; empty groups take the column-wide counts
+        n_values = len(existing_values)
+        counts = np.bincount(group_ids[~column_missing] * n_values + existing_codes,
+                             minlength=n_groups * n_values).reshape(n_groups, n_values)
+        empty = counts.sum(axis=1) == 0
+        counts[empty] = counts.sum(axis=0)
+
+        # inverse CDF sampling of all missing rows at once: row g of the cumulative table is shifted by g,
+        # so one searchsorted over the flattened table serves every group
+        cumulative = np.cumsum(counts, axis=1) / counts.sum(axis=1, keepdims=True)
+        cumulative += np.arange(n_groups)[:, None]
+        missing_groups = group_ids[column_missing]
+        drawn = np.searchsorted(cumulative.ravel(), missing_groups + rng.random(len(missing_groups)), side='right')
+        values = values.copy()
+        values[column_missing] = existing_values[drawn - missing_groups * n_values]
+        file[column] = values
+
+    return file
+
+
+def get_census_2021_base_population(microdata_path: Path = DATA_21_PATH / 'census_microdata_2021_inner_london.csv', simplified=True,
+                                    impute_by=None) -> Population:
+    """Get base population from census 2021 microdata(csv file): load, rename variables, fill missing and simplify categories.
+
+    impute_by (e.g. 'borough_code') draws missing values from the existing values of the same group.
+    """
 
     census_records = pd.read_csv(microdata_path)
     census_records = census_records.reindex(columns=list(VAR_CODE_CENSUS_2021_INIT.keys()))
 
     # fill the missing values based on the value distribution
-    columns_to_fill = ["approximated_social_grade", "economic_activity", "english_proficiency", "ethnic_group","employment_status", # employment_status over 25% missing
-                    "highest_qualification", "marital_status", "number_of_cars_and_vans", ]
-    na_value = -8
-    for col in columns_to_fill:
-        census_records = fillna_column(census_records, col, na_value)
+    census_records = impute_missing(census_records, CENSUS_2021_FILL_COLUMNS, CENSUS_2021_NA_VALUE,
+                                    CENSUS_2021_FILL_SEED, by=impute_by)
 
-    census_demographics = Demographics(VAR_CODE_CENSUS_2021_INIT)
+    # recoding replaces categorizings in place, keep the module-level one intact
+    census_demographics = Demographics(copy.deepcopy(VAR_CODE_CENSUS_2021_INIT))
     population = Population(census_demographics, census_records)
 
     # simplify categories
     if simplified:
         population.recode_variable(new_var_code_cate=VAR_CODE_CENSUS_2021_SIMPLIFIED,
-                                var_recode_map=VAR_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED)
+                                compiled_recode_map=COMPILED_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED)
         
     return population
 
-from tqdm import tqdm
+
+def _census_2021_cache_key(microdata_path: Path, simplified, impute_by=None):
+    """
+    Hash of the microdata file's identity and of every setting that shapes the cleaned base population.
+
+    The file is identified by its resolved path, size and modification time rather than by its contents, so
+    the key costs one stat call instead of a read of the whole CSV; rewriting the file changes its key.
+    """
+    stat = os.stat(microdata_path)
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(Path(microdata_path).resolve()), stat.st_size, stat.st_mtime_ns]).encode())
+
+    settings = {'init': VAR_CODE_CENSUS_2021_INIT, 'fill_columns': CENSUS_2021_FILL_COLUMNS,
+                'na_value': CENSUS_2021_NA_VALUE, 'fill_seed': CENSUS_2021_FILL_SEED, 'fill_method': 'impute_missing',
+                'impute_by': impute_by,
+                'simplified': simplified}
+    if simplified:
+        settings['simplified_codes'] = VAR_CODE_CENSUS_2021_SIMPLIFIED
+        settings['recode_map'] = VAR_RECODE_MAP_CENSUS_2021_INIT2SIMPLIFIED
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _compact_records(records):
+    """Smallest integer type for code columns, categorical for string codes"""
+    records = records.copy()
+    for column in records.columns:
+        if pd.api.types.is_integer_dtype(records[column]):
+            records[column] = pd.to_numeric(records[column], downcast='integer')
+        elif not pd.api.types.is_numeric_dtype(records[column]):
+            records[column] = records[column].astype('category')
+    return records
+
+
+def get_census_2021_base_population_cached(microdata_path: Path = DATA_21_PATH / 'census_microdata_2021_inner_london.csv',
+                                           simplified=True, variables=None, cache_dir: Path = CACHE_PATH,
+                                           impute_by=None) -> Population:
+    """
+    Same base population as get_census_2021_base_population, kept as a Parquet file between runs.
+
+    The cache file is named by a hash of the microdata file's path, size and modification time and of the fill
+    and recode settings, so changing either rebuilds it. Codes are stored in the smallest integer types.
+
+    Parameters:
+        microdata_path (Path): Path to the census microdata CSV file.
+        simplified (bool): If True, recode to VAR_CODE_CENSUS_2021_SIMPLIFIED categories.
+        variables (list or None): Variables to load; only these columns are read. None loads all of them.
+        cache_dir (Path): Folder of the Parquet cache files.
+        impute_by (str or list or None): Column(s) to condition missing-value imputation on, see impute_missing.
+
+    Returns:
+        Population: Base population with uniform weights.
+    """
+    cache_key = _census_2021_cache_key(microdata_path, simplified, impute_by)
+    cache_file = Path(cache_dir) / f'census_2021_base_population_{cache_key}.parquet'
+
+    if not cache_file.exists():
+        population = get_census_2021_base_population(microdata_path, simplified=simplified, impute_by=impute_by)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        _compact_records(population.records[list(population.variables)]).to_parquet(temp_file, index=False)
+        os.replace(temp_file, cache_file)     # never leave a partly written cache file under the final name
+
+    var_code_cate = copy.deepcopy(VAR_CODE_CENSUS_2021_INIT)
+    if simplified:
+        var_code_cate.update(copy.deepcopy(VAR_CODE_CENSUS_2021_SIMPLIFIED))
+    demographics = Demographics(var_code_cate)
+    if variables is not None:
+        demographics = demographics.select(variables)
+
+    records = pd.read_parquet(cache_file, columns=list(demographics.variables))
+    return Population(demographics, records)
+
+
+class AreaPopulations(Mapping):
+    """
+    Read-only mapping from area code to that area's Population, built on first access.
+
+    Records of all areas are held in one frame sorted by area, so every area is a contiguous row slice;
+    the Population of an area shares that slice's data (pandas copies a column only when it is written).
+    """
+
+    def __init__(self, demographics: Demographics, area_codes, offsets, records):
+        self.demographics = demographics
+        self.records = records      # variables and weights of all areas, sorted by area
+        self._slices = {area_code: slice(start, end)
+                        for area_code, start, end in zip(area_codes, offsets[:-1], offsets[1:])}
+        self._populations = {}
+
+    def __getitem__(self, area_code):
+        if area_code not in self._populations:
+            area_records = self.records.iloc[self._slices[area_code]]
+            self._populations[area_code] = Population(demographics=Demographics(self.demographics.var_code_cate),
+                                                      records=area_records[list(self.demographics.variables)],
+                                                      weights=area_records['weights'])
+        return self._populations[area_code]
+
+    def __iter__(self):
+        return iter(self._slices)
+
+    def __len__(self):
+        return len(self._slices)
+
+    def area_size(self, area_code):
+        """Number of records of an area, without building its Population"""
+        area_slice = self._slices[area_code]
+        return area_slice.stop - area_slice.start
+
 
 def get_synthetic_population(syn_pop_path:Path = DATA_PATH / 'results' / 'static'/ 'synthetic_population_LSOA_level.csv', If_ILA=True, area_codes=None):
     """"
-    Load synthetic population from CSV and return a dictionary of Population objects.
+    Load synthetic population from CSV and return a mapping of area codes to Population objects.
+
+    Records are partitioned by area with one sort; each area's Population is only created when it is accessed.
 
     Parameters:
         syn_pop_path (Path): Path to the synthetic population CSV file.
@@ -207,36 +393,31 @@ def get_synthetic_population(syn_pop_path:Path = DATA_PATH / 'results' / 'static
         area_codes (list or None): List of area codes to load if If_ILA is False. Must be provided in that case.
 
     Returns:
-        dict: A dictionary where keys are area codes and values are Population objects.
+        AreaPopulations: A read-only mapping where keys are area codes and values are Population objects.
     
     Raises:
         ValueError: If If_ILA is False but no area_codes are provided.
     """
-    
+    if not If_ILA and not area_codes:
+        raise ValueError('No area code is provided!')
+
     syn_pop_all = pd.read_csv(syn_pop_path)
     syn_pop_var_list = [col for col in syn_pop_all.columns if col != 'weights' and col != 'area_code']
     syn_var_cate_dict = {k:VAR_CODE_CENSUS_2021_SIMPLIFIED[k] for k in syn_pop_var_list}
 
-    syn_pop_dict = {}   # save the syn pop results
-    if If_ILA:          # load all synthetic population results
-        area_codes = syn_pop_all['area_code'].unique()
-        
-        for code in tqdm(area_codes, desc='Loading Synthetic Population'):
-            pop_df = syn_pop_all[syn_pop_all['area_code'] == code]
-
-            records =  pop_df.drop(columns=['area_code', 'weights'])
-            syn_pop_area = Population(demographics=Demographics(syn_var_cate_dict), records=records, weights=pop_df['weights'])
-
-            syn_pop_dict[code] = syn_pop_area
+    # all areas (in order of appearance), or the requested ones; requested areas without records stay empty
+    area_ids, file_area_codes = pd.factorize(syn_pop_all['area_code'])
+    if If_ILA:
+        area_codes = list(file_area_codes)
+        keep = np.ones(len(area_ids), dtype=bool)
     else:
-        if not area_codes:
-            raise ValueError('No area code is provided!')
-        for code in tqdm(area_codes, desc='Loading Synthetic Population'):
-            pop_df = syn_pop_all[syn_pop_all['area_code'] == code]
-
-            records =  pop_df.drop(columns=['area_code', 'weights'])
-            syn_pop_area = Population(demographics=Demographics(syn_var_cate_dict), records=records, weights=pop_df['weights'])
+        area_codes = list(area_codes)
+        positions = pd.Index(area_codes).get_indexer(file_area_codes)
+        area_ids = np.where(area_ids >= 0, positions[area_ids], -1)
+        keep = area_ids >= 0
 
-            syn_pop_dict[code] = syn_pop_area
+    order = np.flatnonzero(keep)[np.argsort(area_ids[keep], kind='stable')]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(area_ids[keep], minlength=len(area_codes)))))
+    records = syn_pop_all[syn_pop_var_list + ['weights']].take(order).reset_index(drop=True)
 
-    return syn_pop_dict
\ No newline at end of file
+    return AreaPopulations(Demographics(syn_var_cate_dict), area_codes, offsets, records)
@@ -0,0 +1,97 @@
+"""
+Columnar store for synthetic populations and orders: a Parquet (GeoParquet for GeoDataFrames) dataset
+partitioned by area code, one folder per area (area_code=<code>/), with row-group statistics in every file.
+
+Readers only touch the requested columns and the requested areas' folders, and read the files memory-mapped,
+so validation and maps no longer parse whole CSV or GPKG files.
+"""
+
+from pathlib import Path
+import json
+import shutil
+
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow.fs import LocalFileSystem
+
+AREA_COLUMN = 'area_code'
+
+
+def _partitioning(partition_column):
+    return ds.partitioning(pa.schema([(partition_column, pa.string())]), flavor='hive')
+
+
+def _geo_metadata(frame):
+    """GeoParquet file metadata of a GeoDataFrame's geometry column (WKB encoded)"""
+    geometry = frame.geometry
+    column = {'encoding': 'WKB', 'geometry_types': sorted(geometry.geom_type.dropna().unique().tolist())}
+    if geometry.crs is not None:
+        column['crs'] = geometry.crs.to_json_dict()
+    return json.dumps({'version': '1.0.0', 'primary_column': geometry.name, 'columns': {geometry.name: column}})
+
+
+def _has_geometry(table):
+    return any((field.metadata or {}).get(b'ARROW:extension:name', b'').startswith(b'geoarrow')
+               for field in table.schema)
+
+
+def write_store(frame, root: Path, partition_column=AREA_COLUMN, row_group_size=64 * 1024):
+    """
+    Write records (DataFrame or GeoDataFrame) as a dataset partitioned by area, replacing any existing store.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): Records with a partition_column; a named index (e.g. Person_ID)
+                                           is stored as an ordinary column.
+        root (Path): Folder of the store.
+        partition_column (str): Column to partition by.
+        row_group_size (int): Maximum rows per row group; each row group carries min/max statistics.
+    """
+    if frame.index.name is not None:
+        frame = frame.reset_index()
+    if isinstance(frame, gpd.GeoDataFrame):
+        table = pa.table(frame.to_arrow(index=False, geometry_encoding='WKB'))
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': _geo_metadata(frame)})
+    else:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.set_column(table.schema.get_field_index(partition_column), partition_column,
+                             table[partition_column].cast(pa.string()))
+
+    root = Path(root)
+    if root.exists():
+        shutil.rmtree(root)
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(table, root, format=file_format, partitioning=_partitioning(partition_column),
+                     file_options=file_format.make_write_options(write_statistics=True, compression='zstd'),
+                     max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 1024),
+                     basename_template='part-{i}.parquet', existing_data_behavior='error')
+
+
+def read_store(root: Path, columns=None, area_codes=None, partition_column=AREA_COLUMN, memory_map=True):
+    """
+    Read records from a store written by write_store.
+
+    Parameters:
+        root (Path): Folder of the store.
+        columns (list or None): Columns to read (the partition column included on request); None reads all.
+        area_codes (list or None): Areas to read; None reads every area.
+        memory_map (bool): Memory-map the Parquet files instead of reading them into buffers.
+
+    Returns:
+        DataFrame or GeoDataFrame: GeoDataFrame when the store holds geometries and they are read.
+    """
+    dataset = ds.dataset(Path(root), format='parquet', partitioning=_partitioning(partition_column),
+                         filesystem=LocalFileSystem(use_mmap=memory_map))
+    area_filter = None if area_codes is None else ds.field(partition_column).isin(list(area_codes))
+    table = dataset.to_table(columns=columns, filter=area_filter)
+
+    if _has_geometry(table):
+        return gpd.GeoDataFrame.from_arrow(table)
+    return table.to_pandas()
+
+
+def store_area_codes(root: Path, partition_column=AREA_COLUMN):
+    """Area codes held in a store, from its folder names, without reading any data"""
+    prefix = partition_column + '='
+    return sorted(path.name[len(prefix):] for path in Path(root).iterdir()
+                  if path.is_dir() and path.name.startswith(prefix))
@@ -20,3 +20,5 @@ RES_SYN_POP_SAMPLE  = RESULTS_PATH / 'static' / 'sample_population'
 # RES_SYN_ORD_PATH    = RESULTS_PATH / 'dynamic-synthetic-order' / 'ver_1'         # path for synthetic order results
 RES_SYN_ORD_PATH    = RESULTS_PATH / 'dynamic-synthetic-order'
 RES_MAP_PATH        = RESULTS_PATH / 'dynamic-html-maps'                # path for visualization map results
+
+CACHE_PATH      = SCRIPT_PATH / 'cache'                     # path for cached intermediate files
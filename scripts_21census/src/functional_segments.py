@@ -53,24 +53,94 @@ def generate_random_points_in_polygon(polygon, num_points, crs='EPSG:27700'):
 
 # convert aggregate population to dictionary form 
 def aggregate_dict(df):
-    agg_dict={}
-    weight_list=list(df['weights'])
     columns=list(df.columns)
     columns.remove('weights')
-    df=df[columns].astype(int)
-    for i in range(df.shape[0]):
-        agg_dict[tuple(df.loc[i,columns])]=weight_list[i]
-    return agg_dict
+    type_keys=map(tuple, df[columns].astype(int).to_numpy().tolist())
+    return dict(zip(type_keys, df['weights'].tolist()))
 
 
 # IPF
 def IPF_Matrix(matrix,row_sum,col_sum):
-    for i in range(50):
-        # column update
-        col_scalars = matrix.sum(axis=0) / col_sum
-        matrix = (matrix / col_scalars)
-        # row update
-        row_scalars = matrix.sum(axis=1) / row_sum
-        matrix = (matrix.T / row_scalars).T
+    """Fixed 50 sweeps of matrix IPF, kept for existing callers; see IPF_Matrix_fit"""
+    matrix, _ = IPF_Matrix_fit(matrix, row_sum, col_sum, max_iter=50, tol=0)
     return matrix
 
+
+def _logsumexp(log_matrix, axis):
+    """log(sum(exp(.))) along an axis, -inf for all -inf slices"""
+    peak = log_matrix.max(axis=axis, keepdims=True)
+    peak = np.where(np.isfinite(peak), peak, 0)
+    with np.errstate(divide='ignore'):
+        return np.squeeze(np.log(np.exp(log_matrix - peak).sum(axis=axis, keepdims=True)) + peak, axis=axis)
+
+
+def IPF_Matrix_fit(matrix, row_sum, col_sum, max_iter=1000, tol=1e-10, log_domain=False):
+    """
+    Scale a non-negative matrix (or a stack of matrices) to given row and column sums: matrix IPF / Sinkhorn.
+
+    Each sweep updates the columns, then the rows, in place on a working copy. Infinite cells (zero cost) take the
+    whole mass of their row, zero cells (infinite cost) stay zero; all-zero rows or columns with a positive target
+    cannot be fitted and show up in the residuals instead of turning the matrix into NaN.
+
+    Parameters:
+        matrix (np.ndarray): Initial matrix of shape (n, m), or (batch, n, m) to fit every matrix of a stack.
+        row_sum (float or array-like): Target row sums, broadcastable to (n,) or (batch, n).
+        col_sum (array-like): Target column sums, broadcastable to (m,) or (batch, m).
+        max_iter (int): Maximum number of sweeps.
+        tol (float): Stop once the largest absolute column-sum deviation (after the row update) is within tol.
+        log_domain (bool): Iterate on log-scale row/column potentials (Sinkhorn), stable for matrices spanning
+                           many orders of magnitude.
+
+    Returns:
+        tuple: (fitted matrix, residual history), the history holding the residual after every sweep;
+               for a stack, one residual per matrix and sweep, shape (sweeps, batch).
+    """
+    matrix = np.array(matrix, dtype=float)
+    if (matrix < 0).any() or np.isnan(matrix).any():
+        raise ValueError("The matrix must be non-negative")
+
+    # a zero-cost (infinite) cell dominates its row: keep only the infinite cells of such rows
+    infinite_rows = np.isinf(matrix).any(axis=-1, keepdims=True)
+    matrix = np.where(infinite_rows, np.isinf(matrix).astype(float), matrix)
+
+    row_sum = np.broadcast_to(np.asarray(row_sum, dtype=float), matrix.shape[:-1])
+    col_sum = np.broadcast_to(np.asarray(col_sum, dtype=float), matrix.shape[:-2] + matrix.shape[-1:])
+    residuals = []
+
+    if log_domain:
+        with np.errstate(divide='ignore'):
+            log_matrix = np.log(matrix)
+            log_row_sum, log_col_sum = np.log(row_sum), np.log(col_sum)
+        row_potential = np.zeros(row_sum.shape)
+
+        for _ in range(max_iter):
+            col_potential = log_col_sum - _logsumexp(log_matrix + row_potential[..., :, None], axis=-2)
+            col_potential = np.where(np.isfinite(col_potential) | (col_sum == 0), col_potential, 0)
+            row_potential = log_row_sum - _logsumexp(log_matrix + col_potential[..., None, :], axis=-1)
+            row_potential = np.where(np.isfinite(row_potential) | (row_sum == 0), row_potential, 0)
+
+            fitted_col_sum = np.exp(_logsumexp(log_matrix + row_potential[..., :, None] + col_potential[..., None, :],
+                                               axis=-2))
+            residual = np.abs(fitted_col_sum - col_sum).max(axis=-1)
+            residuals.append(residual)
+            if residual.max() <= tol:
+                break
+
+        matrix = np.exp(log_matrix + row_potential[..., :, None] + col_potential[..., None, :])
+
+    else:
+        for _ in range(max_iter):
+            # column update
+            col_total = matrix.sum(axis=-2)
+            matrix *= np.divide(col_sum, col_total, out=np.ones_like(col_total), where=col_total > 0)[..., None, :]
+            # row update
+            row_total = matrix.sum(axis=-1)
+            matrix *= np.divide(row_sum, row_total, out=np.ones_like(row_total), where=row_total > 0)[..., :, None]
+
+            residual = np.abs(matrix.sum(axis=-2) - col_sum).max(axis=-1)
+            residuals.append(residual)
+            if residual.max() <= tol:
+                break
+
+    return matrix, np.array(residuals)
+
@@ -1,8 +1,16 @@
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
+from skfuzzy.control.term import TermAggregate
+from itertools import product
+from pathlib import Path
+import hashlib
+import json
+import os
 import numpy as np
 import pandas as pd
 
+from .config import CACHE_PATH
+
 # Initial Random Sampler
 rng = np.random.default_rng(seed=42)
 
@@ -27,136 +35,400 @@ freq_table = pd.DataFrame(freq_table)
 # print(freq_table)
 
 
-def predict_synpop_availability(rules, population):
-    predicted_responses = []
-
-    # Build the Fuzzy Logic System
-    response_ctrl = ctrl.ControlSystem(rules)
-    response_sim = ctrl.ControlSystemSimulation(response_ctrl)
-
-    antecedent_features = [a.label for a in response_ctrl.antecedents]
-    antecedent_features
-    
-    for _, person in tqdm(population.iterrows(), desc='Progressing', total=len(population)):
-        # print(person)
-        # print(person['sex'])
-        for feature in antecedent_features:
-            # print(feature)
-            response_sim.input[feature] = person[feature]
-
-        # simulation
-        response_sim.compute()
-        result = response_sim.output['response']
-        # print(response_sim.output)
-        result_01 = result / 100    # convert within 0-1
-
-        # print(result)
-
-        predicted_responses.append(result_01)
-
-    return predicted_responses
-
-
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-from tqdm import tqdm
-
-def predict_synpop_freq(rules, population, time_window='Orders_per_week'):
+class RuleTable:
     """
-    Returns
-    -------
-    predicted_dist : list of list of float
-        A list where each element corresponds to an individual in the population,
-        containing a normalized fuzzy membership distribution across frequency categories.
+    A rule set evaluated once for every combination of its antecedents' universe values.
 
-    predicted_e : list of float
-        A list of expected frequency values computed as the dot product between the
-        normalized fuzzy distribution and the numeric frequency table.
+    Antecedents of the synthetic population are small categorical codes (age 0-3, sex 0-1 ...), so the crisp
+    output of every possible input is computed up front with skfuzzy and inference becomes an array lookup.
+    Combinations where no rule fires (skfuzzy has no output for them) hold NaN.
     """
-    print(f'Frequency Expectation is within: {time_window}')
-    freq_keys = list(rules.keys())
 
-    ctrl_systems = [ctrl.ControlSystem(rules[key]) for key in freq_keys]
-    response_sims = [ctrl.ControlSystemSimulation(cs) for cs in ctrl_systems]
+    def __init__(self, rules, output='response'):
+        response_ctrl = ctrl.ControlSystem(rules)
+        response_sim = ctrl.ControlSystemSimulation(response_ctrl)
 
-    ante_features = 'age' # only consider age
+        self.antecedents = [a.label for a in response_ctrl.antecedents]
+        self.universes = [np.asarray(a.universe) for a in response_ctrl.antecedents]
+        self.output = output
+        self.values = np.full([len(universe) for universe in self.universes], np.nan)
 
-    predicted_dist = [] # predicted frequency distribution
-    predicted_e = []    # predicted frequency expectation
-
-    for _, person in tqdm(population.iterrows(), desc='Progressing', total=len(population)):
-
-        person_freq_dist = []
+        for position in product(*[range(len(universe)) for universe in self.universes]):
+            for feature, universe, i in zip(self.antecedents, self.universes, position):
+                response_sim.input[feature] = universe[i]
+            response_sim.compute()
+            if output in response_sim.output:
+                self.values[position] = response_sim.output[output]
 
-        for i, freq in enumerate(freq_keys):
-            response_sim = response_sims[i]
+    def positions(self, population):
+        """Positions of the population's antecedent values in the universes, one integer array per antecedent"""
+        positions = []
+        for feature, universe in zip(self.antecedents, self.universes):
+            values = np.asarray(population[feature])
+            position = np.searchsorted(universe, values).clip(0, len(universe) - 1)
+            if (universe[position] != values).any():
+                unknown = sorted(set(values[universe[position] != values].tolist()))
+                raise ValueError("Values %s of %s are not in its universe" % (unknown, feature))
+            positions.append(position)
+        return tuple(positions)
 
-            response_sim.input[ante_features] = person[ante_features]
+    def lookup(self, population):
+        """Crisp output of every row of population (DataFrame or dict of arrays holding the antecedents)"""
+        return self.values[self.positions(population)]
 
-            response_sim.compute()
-            weight = response_sim.output['response']    # weight of each frequency   
 
-            person_freq_dist.append(weight)
+def _distinct_rows(values):
+    """Positions of the first occurrence of every distinct row of a 2-D array, and the inverse positions"""
+    values = np.ascontiguousarray(values)
+    _, first, inverse = np.unique(values.view(np.dtype((np.void, values.itemsize * values.shape[1]))).reshape(-1),
+                                  return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
 
-        # Normalize the frequency distribution
-        total = sum(person_freq_dist)
-        if total > 0:
-            normalized_dist = [round(w / total, 4) for w in person_freq_dist]
-        else:
-            # Handle zero division: assign uniform distribution as fallback
-            normalized_dist = [round(1 / len(person_freq_dist), 4)] * len(person_freq_dist)
 
-        predicted_dist.append(normalized_dist)
-        
-        freq_expectation = np.dot(normalized_dist, freq_table[time_window])  # Expectation of frequency
-        predicted_e.append(freq_expectation)
-        # print(freq_expectation)
+def _trapezoids(x1, x2, y1, y2):
+    """First moment and area of the trapezoids under linear pieces, as in skfuzzy.defuzzify.centroid"""
+    area = 0.5 * (x2 - x1) * (y1 + y2)
+    return (x2 - x1) ** 2 * (y2 + 0.5 * y1) / 3 + x1 * area, area
 
-    return predicted_dist, predicted_e
 
-# from tqdm import tqdm
-# def predict_synord_category(rules, order_df):
-    
-#     rng = np.random.default_rng(seed=42)
-#     cate_keys = list(rules.keys())
-#     # print(cate_keys)
+class BatchMamdani:
+    """
+    Mamdani inference of a skfuzzy rule set over whole input arrays at once.
+
+    Follows ControlSystemSimulation step by step: inputs are clipped to the antecedent universes and fuzzified
+    by linear interpolation, rule antecedents are combined with the rules' and_func / or_func (fmin / fmax) and
+    1 - x for NOT, activations are scaled by the consequent weights (response['low'] % 0.9), accumulated per
+    output term with the consequent's accumulation method (fmax), and defuzzified by the exact centroid of the
+    cut output terms on the universe upsampled at the cut crossings, as skfuzzy does. Outputs match
+    ControlSystemSimulation.compute() within 1e-9; inputs where no rule fires give NaN.
+    """
 
-#     ctrl_systems = [ctrl.ControlSystem(rules[key]) for key in cate_keys]
-#     response_sims = [ctrl.ControlSystemSimulation(cs) for cs in ctrl_systems]
+    def __init__(self, rules, output='response'):
+        # the variables are read from the rules themselves; building a ControlSystem graph is far slower
+        self.rules = list(rules)
+        antecedents = {}
+        for rule in self.rules:
+            for term in self._antecedent_terms(rule.antecedent):
+                antecedents.setdefault(term.parent.label, term.parent)
+        consequents = {c.term.parent.label: c.term.parent for rule in self.rules for c in rule.consequent}
+        if output not in consequents:
+            raise ValueError("The rules have no consequent %s" % output)
+        consequent = consequents[output]
+        if consequent.defuzzify_method != 'centroid':
+            raise ValueError("Only centroid defuzzification is supported, not %s" % consequent.defuzzify_method)
+
+        self.antecedents = list(antecedents)
+        self.output = output
+        self.universe = np.asarray(consequent.universe, dtype=float)
+        self.terms = list(consequent.terms)
+        self._universes = {label: np.asarray(a.universe, dtype=float) for label, a in antecedents.items()}
+        self._term_mfs = np.array([consequent[label].mf for label in self.terms], dtype=float)
+        self._accumulate = consequent.accumulation_method
+        # centroid pieces on the universe are linear in the output membership: moment = y @ w, area = y @ v
+        x1, x2 = self.universe[:-1], self.universe[1:]
+        eye = np.eye(len(self.universe))
+        self._moment_weights, self._area_weights = _trapezoids(x1[:, None], x2[:, None], eye[:-1], eye[1:])
+        self._moment_weights, self._area_weights = self._moment_weights.sum(axis=0), self._area_weights.sum(axis=0)
+        # (term position, weight) of the output terms fired by each rule
+        self._rule_terms = [[(self.terms.index(c.term.label), c.weight) for c in rule.consequent
+                             if c.term.parent is consequent] for rule in self.rules]
+
+    def fuzzify(self, inputs, memberships=None):
+        """
+        Membership of every input in every antecedent term, keyed by (antecedent, term) labels.
+
+        Memberships already in the given dict (e.g. computed for another rule set) are reused, not recomputed.
+        """
+        memberships = {} if memberships is None else memberships
+        for rule in self.rules:
+            for term in self._antecedent_terms(rule.antecedent):
+                key = (term.parent.label, term.label)
+                if key not in memberships:
+                    universe = self._universes[term.parent.label]
+                    values = np.clip(np.asarray(inputs[term.parent.label], dtype=float), universe[0], universe[-1])
+                    memberships[key] = np.interp(values, universe, term.mf)
+        return memberships
+
+    def _antecedent_terms(self, antecedent):
+        if isinstance(antecedent, TermAggregate):
+            terms = self._antecedent_terms(antecedent.term1)
+            return terms if antecedent.term2 is None else terms + self._antecedent_terms(antecedent.term2)
+        if not isinstance(antecedent.parent, ctrl.Antecedent):
+            raise ValueError("Intermediate variable %s is not supported" % antecedent.parent.label)
+        return [antecedent]
+
+    def _firing(self, antecedent, rule, memberships):
+        if not isinstance(antecedent, TermAggregate):
+            return memberships[antecedent.parent.label, antecedent.label]
+        if antecedent.kind == 'not':
+            return 1. - self._firing(antecedent.term1, rule, memberships)
+        combine = rule.and_func if antecedent.kind == 'and' else rule.or_func
+        return combine(self._firing(antecedent.term1, rule, memberships),
+                       self._firing(antecedent.term2, rule, memberships))
+
+    def fire(self, memberships, size):
+        """Accumulated activation (cut) of every output term, as a (size x terms) array"""
+        cuts = [None] * len(self.terms)
+        for rule, rule_terms in zip(self.rules, self._rule_terms):
+            firing = np.broadcast_to(self._firing(rule.antecedent, rule, memberships), (size,))
+            for position, weight in rule_terms:
+                activation = firing * weight
+                cuts[position] = activation if cuts[position] is None else self._accumulate(activation, cuts[position])
+        return np.column_stack([np.zeros(size) if cut is None else cut for cut in cuts])
+
+    def defuzzify(self, cuts, chunk_size=4096):
+        """Centroid of the output membership function of every row of cuts; NaN where it is empty"""
+        # rows of categorical inputs repeat the same few cuts, each distinct one is defuzzified once
+        cuts = np.atleast_2d(np.asarray(cuts, dtype=float))
+        first, inverse = _distinct_rows(cuts)
+        cuts = cuts[first]
+        crisp = np.empty(len(cuts))
+        for start in range(0, len(cuts), chunk_size):
+            crisp[start:start + chunk_size] = self._centroid(cuts[start:start + chunk_size])
+        return crisp[inverse]
+
+    def _centroid(self, cuts):
+        x, dx, mfs = self.universe, np.diff(self.universe), self._term_mfs
+
+        # output membership (max of the cut terms) at the universe points, and its centroid pieces
+        y = np.minimum(mfs[None, :, :], cuts[:, :, None]).max(axis=1)
+        moment, area = y @ self._moment_weights, y @ self._area_weights
+
+        # skfuzzy upsamples the universe where a term crosses its cut level: replace the pieces of those
+        # segments by the pieces between the crossing points (zero cuts only cross at universe points)
+        cut = cuts[:, :, None]
+        crossing = ((mfs[None, :, :-1] >= cut) != (mfs[None, :, 1:] >= cut)) & (cut > 0)
+        rows, terms, segments = np.nonzero(crossing)
+        if len(rows):
+            mf0, mf1 = mfs[:, segments], mfs[:, segments + 1]
+            points = x[segments] + (cuts[rows, terms] - mf0[terms, np.arange(len(rows))]) * dx[segments] / \
+                (mf1[terms, np.arange(len(rows))] - mf0[terms, np.arange(len(rows))])
+            fraction = (points - x[segments]) / dx[segments]
+            values = np.minimum(mf0 + (mf1 - mf0) * fraction, cuts[rows].T).max(axis=0)
+
+            order = np.lexsort((points, segments, rows))
+            rows, segments, points, values = rows[order], segments[order], points[order], values[order]
+            first = np.r_[True, (rows[1:] != rows[:-1]) | (segments[1:] != segments[:-1])]
+            last = np.r_[first[1:], True]
+            start_x = np.where(first, x[segments], np.r_[0., points[:-1]])
+            start_y = np.where(first, y[rows, segments], np.r_[0., values[:-1]])
+
+            pieces = [(rows, *_trapezoids(start_x, points, start_y, values), 1),
+                      (rows[last], *_trapezoids(points[last], x[segments[last] + 1],
+                                                values[last], y[rows[last], segments[last] + 1]), 1),
+                      (rows[first], *_trapezoids(x[segments[first]], x[segments[first] + 1],
+                                                 y[rows[first], segments[first]],
+                                                 y[rows[first], segments[first] + 1]), -1)]
+            for piece_rows, piece_moment, piece_area, sign in pieces:
+                moment += sign * np.bincount(piece_rows, weights=piece_moment, minlength=len(cuts))
+                area += sign * np.bincount(piece_rows, weights=piece_area, minlength=len(cuts))
+
+        centroid = moment / np.fmax(area, np.finfo(float).eps)
+        return np.where(y.sum(axis=1) == 0, np.nan, centroid)
+
+    def compute(self, inputs, chunk_size=4096):
+        """
+        Crisp output of every input row.
+
+        Parameters:
+            inputs (DataFrame or dict): Values of every antecedent, one array (or column) per antecedent label.
+            chunk_size (int): Rows defuzzified at a time, bounding the memory of the upsampled universes.
+
+        Returns:
+            np.ndarray: Crisp output per row, NaN where no rule fires.
+        """
+        size = len(np.asarray(inputs[self.antecedents[0]])) if self.antecedents else 1
+        return self.defuzzify(self.fire(self.fuzzify(inputs), size), chunk_size=chunk_size)
+
+
+class MultiOutputMamdani:
+    """
+    Several rule sets (one per frequency class or product category) evaluated together as a distribution.
 
-#     ante_features = [[a.label for a in cs.antecedents] for cs in ctrl_systems]
+    Every input is fuzzified once and the memberships are shared by all rule sets; the crisp output of each
+    rule set is the weight of its class, and the weights of each input are normalized to a distribution.
+    """
 
-#     predicted_dist = [] # predicted category distribution
-#     predicted_cate = []
+    def __init__(self, rule_sets: dict, output='response'):
+        self.keys = list(rule_sets)
+        self.engines = [BatchMamdani(rule_sets[key], output=output) for key in self.keys]
+        self.antecedents = list(dict.fromkeys(a for engine in self.engines for a in engine.antecedents))
+
+    def weights(self, inputs, chunk_size=4096):
+        """(inputs x rule sets) crisp outputs, NaN where no rule of a rule set fires"""
+        # persons of the same type share their inputs: every distinct input row is evaluated once
+        values = np.column_stack([np.asarray(inputs[a], dtype=float) for a in self.antecedents])
+        first, inverse = _distinct_rows(values)
+        distinct = {a: values[first, j] for j, a in enumerate(self.antecedents)}
+
+        memberships = {}
+        for engine in self.engines:
+            engine.fuzzify(distinct, memberships)
+        weights = np.column_stack([engine.defuzzify(engine.fire(memberships, len(first)), chunk_size=chunk_size)
+                                   for engine in self.engines])
+        return weights[inverse]
+
+    def predict(self, inputs, values=None, chunk_size=4096):
+        """
+        Normalized distribution over the rule sets of every input, and its expectation.
+
+        Parameters:
+            inputs (DataFrame or dict): Values of every antecedent, one array (or column) per antecedent label.
+            values (array-like or None): Value of each rule set's class, e.g. freq_table[time_window].
+            chunk_size (int): Rows defuzzified at a time.
+
+        Returns:
+            tuple: (distribution, expectation). distribution is an (inputs x rule sets) array whose rows sum to 1
+                   (uniform where all weights are 0); expectation is distribution @ values, None without values.
+        """
+        weights = self.weights(inputs, chunk_size=chunk_size)
+        failed = np.isnan(weights).any(axis=0)
+        if failed.any():
+            raise ValueError("No rule of %s fires for some inputs" % [key for key, f in zip(self.keys, failed) if f])
+
+        total = weights.sum(axis=1, keepdims=True)
+        distribution = np.divide(weights, total, out=np.full(weights.shape, 1 / len(self.keys)), where=total > 0)
+        expectation = None if values is None else distribution @ np.asarray(values, dtype=float)
+        return distribution, expectation
 
-#     for row in tqdm(order_df.itertuples(index=False), desc='Progressing', total=len(order_df)):
 
-#         person_cate_dist = []
+def predict_synpop_availability(rules, population):
+    """E-commerce availability (0-1) of every person, read from the rule set compiled into a RuleTable"""
+    rule_table = RuleTable(rules)
+    predicted_responses = rule_table.lookup(population) / 100    # convert within 0-1
 
-#         for i, cate_key in enumerate(cate_keys):
-#             response_sim = response_sims[i]
+    if np.isnan(predicted_responses).any():
+        raise ValueError("No availability rule fires for some persons of the population")
+    return predicted_responses.tolist()
 
-#             for feature in ante_features[i]:
-#                 response_sim.input[feature] = getattr(row, feature)
 
-#             response_sim.compute()
-#             weight = response_sim.output['response']    # weight of each frequency   
+def predict_synpop_freq(rules, population, time_window='Orders_per_week'):
+    """
+    Returns
+    -------
+    predicted_dist : list of list of float
+        A list where each element corresponds to an individual in the population,
+        containing a normalized fuzzy membership distribution across frequency categories.
 
-#             person_cate_dist.append(weight)
+    predicted_e : list of float
+        A list of expected frequency values computed as the dot product between the
+        normalized fuzzy distribution and the numeric frequency table.
+    """
+    print(f'Frequency Expectation is within: {time_window}')
 
-#         # Normalize the frequency distribution
-#         total = sum(person_cate_dist)
-#         if total > 0:
-#             normalized_dist = [w / total for w in person_cate_dist]
-#         else:
-#             normalized_dist = [1 / len(person_cate_dist)] * len(person_cate_dist)
+    # normalized frequency distribution (uniform where no frequency has weight) of every person
+    normalized_dist, _ = MultiOutputMamdani(rules).predict(population)
+    normalized_dist = normalized_dist.round(4)
 
-#         normalized_round = [round(w, 4) for w in normalized_dist]
+    predicted_dist = normalized_dist.tolist()  # predicted frequency distribution
+    predicted_e = (normalized_dist @ freq_table[time_window].to_numpy()).tolist()   # predicted frequency expectation
 
-#         predicted_dist.append(normalized_round)
+    return predicted_dist, predicted_e
 
-#         # Sample: Discrete Random Variable Sample
-#         order_cate = rng.choice(len(cate_keys), p=normalized_dist)
-#         predicted_cate.append(order_cate)
+def predict_synpop_category(rules, population):
+    """
+    Normalized product category distribution of every person, one rule set per category.
 
-#     return predicted_dist, predicted_cate
\ No newline at end of file
+    Returns:
+        np.ndarray: (persons x categories) distribution in the order of rules' keys, uniform where no
+                    category has weight.
+    """
+    predicted_dist, _ = MultiOutputMamdani(rules).predict(population)
+    return predicted_dist
+
+
+def _variable_spec(variable):
+    """Definition of a fuzzy variable: universe, membership function of every term and its methods"""
+    spec = {'kind': type(variable).__name__, 'universe': np.asarray(variable.universe).tolist(),
+            'terms': {label: np.asarray(term.mf).tolist() for label, term in variable.terms.items()},
+            'defuzzify_method': variable.defuzzify_method}
+    if hasattr(variable, 'accumulation_method'):
+        spec['accumulation_method'] = variable.accumulation_method.__name__
+    return spec
+
+
+def _antecedent_spec(antecedent, variables):
+    if isinstance(antecedent, TermAggregate):
+        return [antecedent.kind, _antecedent_spec(antecedent.term1, variables),
+                None if antecedent.term2 is None else _antecedent_spec(antecedent.term2, variables)]
+    variables[antecedent.parent.label] = _variable_spec(antecedent.parent)
+    return [antecedent.parent.label, antecedent.label]
+
+
+def rule_set_spec(rules, variables):
+    """Canonical description of a rule list; the fuzzy variables the rules use are added to variables"""
+    spec = []
+    for rule in rules:
+        consequents = []
+        for c in rule.consequent:
+            variables[c.term.parent.label] = _variable_spec(c.term.parent)
+            consequents.append([c.term.parent.label, c.term.label, float(c.weight)])
+        spec.append({'antecedent': _antecedent_spec(rule.antecedent, variables), 'consequent': consequents,
+                     'and_func': rule.and_func.__name__, 'or_func': rule.or_func.__name__})
+    return spec
+
+
+def fuzzy_cache_key(rule_sets: dict, population=None, **settings):
+    """
+    Hash of everything that determines fuzzy inference results: every rule (antecedent terms, operators,
+    consequent terms and weights), the order of the rule lists in a dict, the definitions of the fuzzy
+    variables they use, freq_table, the population scored and any other settings. Changing any rule or membership function changes the key.
+
+    Parameters:
+        rule_sets (dict): Maps a name to a rule list or to a dict of rule lists (e.g. rules_per_frequency).
+        population (DataFrame or None): Inputs the rules are applied to.
+        settings: Other arguments of the inference, e.g. time_window.
+    """
+    variables = {}
+    # sort_keys below drops dict order, but the order of a dict of rule lists is the column order of its results
+    rules_spec = {name: ({'__order__': [str(key) for key in rules],
+                          **{key: rule_set_spec(rules[key], variables) for key in rules}}
+                         if isinstance(rules, dict) else rule_set_spec(rules, variables))
+                  for name, rules in rule_sets.items()}
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps({'rules': rules_spec, 'variables': variables, 'settings': settings,
+                              'freq_table': freq_table.to_dict(orient='split')},
+                             sort_keys=True, default=str).encode())
+    if population is not None:
+        digest.update(json.dumps([str(column) for column in population.columns]).encode())
+        digest.update(pd.util.hash_pandas_object(population, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def score_person_types(person_types, rules_availability, rules_per_frequency, rules_per_product,
+                       time_window='Orders_per_week', cache_dir: Path = CACHE_PATH):
+    """
+    Person types with their availability (avail_prob), frequency distribution (freq_prob) and expectation
+    (freq_e) and category distribution (cate_dist), kept as a Parquet file between runs.
+
+    The cache file is named by fuzzy_cache_key of the rules, the person types and time_window, so a cached
+    result is read without running any inference, and any rule change computes and stores a new one.
+
+    Parameters:
+        person_types (DataFrame): One row per person type, with a column per antecedent.
+        rules_availability (list): Rules of e-commerce availability.
+        rules_per_frequency (dict): Rule list of every frequency class.
+        rules_per_product (dict): Rule list of every product category.
+        time_window (str): Column of freq_table the frequency expectation is given in.
+        cache_dir (Path): Folder of the Parquet cache files.
+
+    Returns:
+        DataFrame: person_types with the four columns added; distributions are arrays in their cells.
+    """
+    cache_key = fuzzy_cache_key({'availability': rules_availability, 'frequency': rules_per_frequency,
+                                 'category': rules_per_product}, person_types, time_window=time_window)
+    cache_file = Path(cache_dir) / f'fuzzy_person_types_{cache_key}.parquet'
+
+    if not cache_file.exists():
+        scored = person_types.copy()
+        scored['avail_prob'] = predict_synpop_availability(rules_availability, person_types)
+        scored['freq_prob'], scored['freq_e'] = predict_synpop_freq(rules_per_frequency, person_types, time_window)
+        scored['cate_dist'] = list(predict_synpop_category(rules_per_product, person_types))
+
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        scored.to_parquet(temp_file)
+        os.replace(temp_file, cache_file)     # never leave a partly written cache file under the final name
+
+    return pd.read_parquet(cache_file)
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import hashlib
+import json
+import os
+import numpy as np
 import pandas as pd
 
 # Project configuration
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 CURR_PATH   = Path.cwd()
@@ -17,6 +23,7 @@ DATA_GIS_PATH   = REPO_PATH / "data" / 'gis-files'          # path for all gis f
 
 RESULTS_PATH    = REPO_PATH / "data" / 'results'            # path for all generated results
 RES_STATIC      = RESULTS_PATH / 'static'                           # path for all intermediate results
+CACHE_PATH      = REPO_PATH / 'scripts_21census' / 'cache'          # path for cached intermediate files
 
 sys.path.append(str(SCR_PATH))
 
@@ -44,91 +51,237 @@ ILA_OA_CODE = ILA_coding['LSOA_CODE'].unique()  # Temporary
 # London Borough (lb) or Local Authority District (lad)
 # Middle Super Output Area (msoa)       # Lower Super Output Area (lsoa)
 
-# Get marginal distribution_age
-def marg_age_dist(space_level='MSOA'):
-    """Return Marginal Distribution of Age Attribute in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS007-Age-By-Single-Year-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS007-Age-By-Single-Year-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        print('Error: For Age attribute, there is no LSOA level statistics!')
-        return 
-    if space_level == 'OA': 
-        print('Error: For Age attribute, there is no OA level statistics!')
-        return 
-    
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Age (101 categories) Code', values='Observation')
-
-    marg_var_wide["0-15"] = marg_var_wide[list(range(0, 16))].sum(axis="columns")
-    marg_var_wide["16-29"] = marg_var_wide[list(range(16, 30))].sum(axis="columns")
-    marg_var_wide["30-49"] = marg_var_wide[list(range(30, 50))].sum(axis="columns")
-    age_cols_50_plus = [col for col in marg_var_wide.columns if isinstance(col, int) and col >= 50]
-    marg_var_wide["50+"] = marg_var_wide[age_cols_50_plus].sum(axis="columns")
-    marg_var_summary = marg_var_wide[["0-15", "16-29", "30-49", "50+"]].copy()
+SPACE_LEVEL_CODE_COLUMN = {
+    "LAD": 'Lower tier local authorities Code',
+    "MSOA": 'Middle layer Super Output Areas Code',
+    "LSOA": 'Lower layer Super Output Areas Code',
+    "OA": 'Output Areas Code',
+}
+SPACE_LEVEL_FILE_TAG = {"LAD": "ltla", "MSOA": "msoa", "LSOA": "lsoa", "OA": "oa"}
+
+# Census table of every marginal variable: file name stem, category column, geography levels it is published at,
+# and the grouping of its categories into our codes. A group is a list of category values, or a label prefix.
+MARGINAL_TABLE_SPECS = {
+    "age": {
+        "table": "TS007-Age-By-Single-Year-2021",
+        "category_column": "Age (101 categories) Code", "category_dtype": "int16",
+        "levels": ("LAD", "MSOA"),
+        "groups": {0: list(range(0, 16)), 1: list(range(16, 30)), 2: list(range(30, 50)), 3: list(range(50, 101))},
+    },
+    "sex": {
+        "table": "TS008-Sex-2021",
+        "category_column": "Sex (2 categories) Code", "category_dtype": "int8",
+        "levels": ("LAD", "MSOA", "LSOA", "OA"),
+        "groups": {0: [1], 1: [2]},
+    },
+    "ethnic_group": {
+        "table": "TS021-Ethnic-Group-2021",
+        "category_column": "Ethnic group (20 categories)", "category_dtype": "string",
+        "levels": ("LAD", "MSOA", "LSOA"),
+        "groups": {0: "Asian", 1: "Black", 2: "Mixed", 3: "White", 4: "Other"},
+    },
+    "economic_activity": {
+        "table": "TS066-Economic-Activity-Status-2021",
+        "category_column": "Economic activity status (20 categories) Code", "category_dtype": "int8",
+        "levels": ("LAD", "MSOA", "LSOA", "OA"),
+        "groups": {0: [1, 2, 3, 4, 5, 6, 8], 1: [7, 9], 2: [10, 11, 12, 13, 14]},
+    },
+    "number_of_cars_and_vans": {
+        "table": "TS045-Car-Or-Van-Availability-2021",
+        "category_column": "Car or van availability (5 categories) Code", "category_dtype": "int8",
+        "levels": ("LAD", "MSOA", "LSOA", "OA"),
+        "groups": {0: [0], 1: [1], 2: [2], 3: [3]},
+    },
+    "marital_status": {
+        "table": "TS002-Legal-Partnership-Status-2021",
+        "category_column": "Marital and civil partnership status (12 categories) Code", "category_dtype": "int8",
+        "levels": ("LAD", "MSOA", "LSOA"),
+        "groups": {0: [1], 1: [2, 3, 4, 5], 2: [6, 7, 8, 9, 10, 11]},
+    },
+}
+
+
+def _category_groups(categories, groups):
+    """Map every category value to its group code; categories outside all groups are left out"""
+    category_group = {}
+    for group_code, members in groups.items():
+        if isinstance(members, str):
+            members = [category for category in categories if category.startswith(members)]
+        category_group.update({category: group_code for category in members})
+    return category_group
+
+
+@lru_cache(maxsize=None)
+def _read_marginal_table(variable, space_level):
+    """Read one census table (only its area, category and observation columns) and group it, once per process"""
+    spec = MARGINAL_TABLE_SPECS[variable]
+    if space_level not in spec["levels"]:
+        raise ValueError("There is no %s level statistics for %s" % (space_level, variable))
+
+    code_column = SPACE_LEVEL_CODE_COLUMN[space_level]
+    var_stat_file = (DATA_21_PATH / "statistic-summary" / space_level /
+                     f"{spec['table']}-{SPACE_LEVEL_FILE_TAG[space_level]}-ONS.csv")
+    table = pd.read_csv(var_stat_file, usecols=[code_column, spec["category_column"], "Observation"],
+                        dtype={code_column: "string", spec["category_column"]: spec["category_dtype"],
+                               "Observation": "int64"}, engine="c")
+
+    ILA_CODE = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}[space_level]
+    table = table[table[code_column].isin(ILA_CODE)]
+
+    categories = table[spec["category_column"]]
+    group = categories.map(_category_groups(categories.unique(), spec["groups"]))
+    table = table.assign(group=group).dropna(subset=["group"])
+
+    marg_var_wide = table.groupby([code_column, "group"])["Observation"].sum().unstack(fill_value=0)
+    marg_var_wide = marg_var_wide.reindex(columns=list(spec["groups"]), fill_value=0)
 
     # add summary row
-    var_sum_row = marg_var_summary.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_summary, pd.DataFrame([var_sum_row], index=["TOTAL"])])
-
+    var_sum_row = marg_var_wide.sum(axis=0)
+    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])])
     marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-    marg_var_summary.rename(columns={"0-15": 0, "16-29": 1, "30-49":2, "50+": 3}, inplace=True)
-    
+
     # rename the index and columns
+    marg_var_summary.index = marg_var_summary.index.astype(object)
     marg_var_summary.index.name = 'GEO_CODE'
+    marg_var_summary.columns = list(spec["groups"])
     marg_var_summary.columns.name = None
-    
     return marg_var_summary
 
-# marg_age_dist(space_level='OA')   # Usage
 
+def marginal_distribution(variable, space_level='MSOA'):
+    """Return Marginal Distribution of a variable of MARGINAL_TABLE_SPECS in designated space level: LAD, MSOA, LSOA, OA"""
+    return _read_marginal_table(variable, space_level).copy()
+
+
+def marginal_distributions(variables=None, space_level='MSOA', max_workers=None):
+    """
+    Return the Marginal Distributions of several variables in one space level, parsing their tables in parallel.
+
+    Parameters:
+        variables (list or None): Variables of MARGINAL_TABLE_SPECS; None takes all of them.
+        space_level (str): LAD, MSOA, LSOA or OA.
+        max_workers (int or None): Number of parsing threads.
+
+    Returns:
+        dict: Maps each variable to its distribution table (one row per area plus TOTAL, one column per code).
+    """
+    variables = list(MARGINAL_TABLE_SPECS) if variables is None else list(variables)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(lambda variable: marginal_distribution(variable, space_level), variables))
+    return dict(zip(variables, tables))
+
+
+# column of each geography level in the ILA coding scheme, used to map areas to the areas containing them
+ILA_CODING_COLUMN = {"LAD": 'LAD_CODE', "MSOA": 'MSOA_CODE', "LSOA": 'LSOA_CODE'}
+
+
+def _marginal_table_file(variable, space_level):
+    spec = MARGINAL_TABLE_SPECS[variable]
+    return (DATA_21_PATH / "statistic-summary" / space_level /
+            f"{spec['table']}-{SPACE_LEVEL_FILE_TAG[space_level]}-ONS.csv")
+
+
+def _file_identity(path):
+    """Resolved path, size and modification time of a file: one stat call instead of a read of its contents"""
+    stat = os.stat(path)
+    return [str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+def constraint_tensor(variables, space_level='LSOA', variable_levels=None, cache_dir=CACHE_PATH, mmap_mode='r'):
+    """
+    Return the (areas x variables x categories) constraint tensor of a space level, built once and kept on disk.
+
+    The tensor is stored as .npy (memory-mappable, unlike .npz) next to a .json index of area codes, variables and
+    source files. Its file name hashes the ordered variables, the path, size and modification time of the source
+    CSVs, the space level and the variable levels, so a rewritten table or a changed setting builds a new tensor.
+
+    Parameters:
+        variables (list): Variables of MARGINAL_TABLE_SPECS, in constraint order.
+        space_level (str): Level of the areas (rows): LAD, MSOA or LSOA.
+        variable_levels (dict or None): Coarser level to take a variable from when it is not published at
+                                        space_level, e.g. {'age': 'MSOA'}: every area gets the distribution of the
+                                        area containing it.
+        cache_dir (Path): Folder of the cached tensors.
+        mmap_mode (str or None): Passed to np.load; 'r' maps the file read-only, None reads it into memory.
+
+    Returns:
+        tuple: (tensor, area_codes). tensor[i, j, k] is the share of category k (in the spec's group order) of
+               variable j in area area_codes[i]; variables with fewer categories are zero padded.
+    """
+    variables = list(variables)
+    variable_levels = {var: (variable_levels or {}).get(var, space_level) for var in variables}
+    sources = {var: _marginal_table_file(var, level) for var, level in variable_levels.items()}
+
+    # variables is a list, so sort_keys keeps its order, which is the order of the tensor's variable axis
+    digest = hashlib.sha1(json.dumps({'variables': variables, 'space_level': space_level,
+                                      'variable_levels': variable_levels,
+                                      'groups': {var: MARGINAL_TABLE_SPECS[var]['groups'] for var in variables},
+                                      'sources': {var: _file_identity(path) for var, path in sources.items()}},
+                                     sort_keys=True, default=str).encode()).hexdigest()
+    tensor_file = Path(cache_dir) / f'constraint_tensor_{space_level}_{digest}.npy'
+    index_file = tensor_file.with_suffix('.json')
+
+    if tensor_file.exists() and index_file.exists():
+        with open(index_file) as file:
+            index = json.load(file)
+        cached = index['variables'] == variables
+    else:
+        cached = False
+
+    if not cached:
+        tables = {}
+        for var, level in variable_levels.items():
+            table = marginal_distribution(var, level).drop(index='TOTAL')
+            if level != space_level:
+                parents = ILA_coding[[ILA_CODING_COLUMN[space_level], ILA_CODING_COLUMN[level]]].drop_duplicates()
+                parents = parents.set_index(ILA_CODING_COLUMN[space_level])[ILA_CODING_COLUMN[level]]
+                parents = parents[parents.isin(table.index)]
+                table = table.loc[parents.to_numpy()].set_axis(parents.index, axis=0)
+            tables[var] = table
+
+        # areas of the space level published in every table, in coding scheme order
+        ILA_CODE = pd.Index(ILA_coding[ILA_CODING_COLUMN[space_level]].unique())
+        area_codes = [code for code in ILA_CODE if all(code in table.index for table in tables.values())]
+
+        max_cates = max(len(MARGINAL_TABLE_SPECS[var]['groups']) for var in variables)
+        tensor = np.zeros((len(area_codes), len(variables), max_cates))
+        for j, var in enumerate(variables):
+            categories = list(MARGINAL_TABLE_SPECS[var]['groups'])
+            tensor[:, j, :len(categories)] = tables[var].loc[area_codes, categories].to_numpy(dtype=float)
+
+        # write under temporary names first, so that a partly written tensor is never picked up
+        tensor_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_suffix = f'.{os.getpid()}.tmp'
+        np.save(tensor_file.with_suffix(temp_suffix), tensor, allow_pickle=False)
+        os.replace(tensor_file.with_suffix(temp_suffix + '.npy'), tensor_file)
+        index = {'area_codes': area_codes, 'variables': variables, 'variable_levels': variable_levels,
+                 'sources': {var: str(path) for var, path in sources.items()}}
+        with open(index_file.with_suffix(temp_suffix), 'w') as file:
+            json.dump(index, file)
+        os.replace(index_file.with_suffix(temp_suffix), index_file)
+
+    return np.load(tensor_file, mmap_mode=mmap_mode), index['area_codes']
+
+
+def _marg_dist(variable, space_level, description):
+    if space_level not in MARGINAL_TABLE_SPECS[variable]["levels"]:
+        print(f'Error: For {description} attribute, there is no {space_level} level statistics!')
+        return
+    return marginal_distribution(variable, space_level)
 
-# Get marginal distribution_sex
-def marg_sex_dist(space_level='MSOA'):
-    """Return Marginal Distribution of Sex Attribute in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS008-Sex-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS008-Sex-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS008-Sex-2021-lsoa-ONS.csv"
-        var_col_name = 'Lower layer Super Output Areas Code'
-    if space_level == 'OA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS008-Sex-2021-oa-ONS.csv"
-        var_col_name = 'Output Areas Code'
-    
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Sex (2 categories) Code', values='Observation')
 
-    # add summary row
-    var_sum_row = marg_var_wide.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])])
+# Get marginal distribution_age
+def marg_age_dist(space_level='MSOA'):
+    """Return Marginal Distribution of Age Attribute in designated space level: LAD, MSOA, LSOA, OA"""
+    return _marg_dist("age", space_level, "Age")
 
-    marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-    marg_var_summary.rename(columns={1: 0, 2: 1}, inplace=True)
+# marg_age_dist(space_level='OA')   # Usage
 
-    # rename the index and columns
-    marg_var_summary.index.name = 'GEO_CODE'
-    marg_var_summary.columns.name = None
 
-    return marg_var_summary
+# Get marginal distribution_sex
+def marg_sex_dist(space_level='MSOA'):
+    """Return Marginal Distribution of Sex Attribute in designated space level: LAD, MSOA, LSOA, OA"""
+    return _marg_dist("sex", space_level, "Sex")
 
 # marg_sex_dist(space_level='LAD')
 
@@ -136,48 +289,7 @@ def marg_sex_dist(space_level='MSOA'):
 # Get marginal distribution_ethnic
 def marg_ethnic_dist(space_level='MSOA'):
     """Return Marginal Distribution of Ethnic Group Attribute in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS021-Ethnic-Group-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS021-Ethnic-Group-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS021-Ethnic-Group-2021-lsoa-ONS.csv"
-        var_col_name = 'Lower layer Super Output Areas Code'
-    if space_level == 'OA': 
-        print('Error: For Ethnic Group attribute, there is no OA level statistics!')
-        return 
-    
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Ethnic group (20 categories)', values='Observation')
-
-    # add summary row
-    marg_var_wide['Asian'] = marg_var_wide[marg_var_wide.columns[[x.startswith("Asian") for x in marg_var_wide.columns]]].sum(axis='columns')
-    marg_var_wide['Black'] = marg_var_wide[marg_var_wide.columns[[x.startswith("Black") for x in marg_var_wide.columns]]].sum(axis='columns')
-    marg_var_wide['Mixed'] = marg_var_wide[marg_var_wide.columns[[x.startswith("Mixed") for x in marg_var_wide.columns]]].sum(axis='columns')
-    marg_var_wide['White'] = marg_var_wide[marg_var_wide.columns[[x.startswith("White") for x in marg_var_wide.columns]]].sum(axis='columns')
-    marg_var_wide['Other'] = marg_var_wide[marg_var_wide.columns[[x.startswith("Other") for x in marg_var_wide.columns]]].sum(axis='columns')
-
-    marg_var_wide = marg_var_wide[["Asian", "Black", "Mixed", "White", "Other"]]
-
-    var_sum_row = marg_var_wide.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])])
-
-    marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-    marg_var_summary.rename(columns={"Asian":0, "Black":1, "Mixed":2, "White":3, "Other":4}, inplace=True)
-
-    # rename the index and columns
-    marg_var_summary.index.name = 'GEO_CODE'
-    marg_var_summary.columns.name = None
-    
-    return marg_var_summary
+    return _marg_dist("ethnic_group", space_level, "Ethnic Group")
 
 # marg_ethnic_dist(space_level='MSOA')
 
@@ -185,45 +297,7 @@ def marg_ethnic_dist(space_level='MSOA'):
 # Get marginal distribution_economic activity
 def marg_ecoact_dist(space_level='MSOA'):
     """Return Marginal Distribution of Economic Activity Status Attribute in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS066-Economic-Activity-Status-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS066-Economic-Activity-Status-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS066-Economic-Activity-Status-2021-lsoa-ONS.csv"
-        var_col_name = 'Lower layer Super Output Areas Code'
-    if space_level == 'OA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS066-Economic-Activity-Status-2021-oa-ONS.csv"
-        var_col_name = 'Output Areas Code'
-
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Economic activity status (20 categories) Code', values='Observation')
-
-    marg_var_wide['Employed'] = marg_var_wide[[1, 2, 3, 4, 5, 6, 8]].sum(axis='columns')
-    marg_var_wide['Unemployed'] = marg_var_wide[[7, 9]].sum(axis='columns')
-    marg_var_wide['Inactive'] = marg_var_wide[[10, 11, 12, 13, 14]].sum(axis='columns')
-    marg_var_wide = marg_var_wide[['Employed', 'Unemployed', 'Inactive']]
-
-    # add summary row
-    var_sum_row = marg_var_wide.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])])
-
-    marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-    marg_var_summary.rename(columns={"Employed":0, "Unemployed":1, "Inactive":2}, inplace=True)
-
-    # rename the index and columns
-    marg_var_summary.index.name = 'GEO_CODE'
-    marg_var_summary.columns.name = None
-
-    return marg_var_summary
+    return _marg_dist("economic_activity", space_level, "Economic Activity Status")
 
 # marg_ecoact_dist(space_level='LAD')
 
@@ -231,38 +305,7 @@ def marg_ecoact_dist(space_level='MSOA'):
 # Get marginal distribution_car_numbers
 def marg_car_dist(space_level='MSOA'):
     """Return Marginal Distribution of Car/Van Availability Attribute in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS045-Car-Or-Van-Availability-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS045-Car-Or-Van-Availability-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS045-Car-Or-Van-Availability-2021-lsoa-ONS.csv"
-        var_col_name = 'Lower layer Super Output Areas Code'
-    if space_level == 'OA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS045-Car-Or-Van-Availability-2021-oa-ONS.csv"
-        var_col_name = 'Output Areas Code'
-
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Car or van availability (5 categories) Code', values='Observation')
-
-    # add summary row
-    var_sum_row = marg_var_wide.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])]).drop(columns=[-8])
-    marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-
-    # rename the index and columns
-    marg_var_summary.index.name = 'GEO_CODE'
-    marg_var_summary.columns.name = None
-    
-    return marg_var_summary
+    return _marg_dist("number_of_cars_and_vans", space_level, "Car/Van Availability")
 
 # marg_car_dist(space_level='LAD')
 
@@ -270,45 +313,7 @@ def marg_car_dist(space_level='MSOA'):
 # Get marginal distribution_legal partnership
 def marg_leptnershp_dist(space_level='MSOA'):
     """Return Marginal Distribution of Legal Partnership Status in designated space level: LAD, MSOA, LSOA, OA"""
-    code_dict_map = {"LAD": ILA_LAD_CODE, "MSOA": ILA_MSOA_CODE, "LSOA": ILA_LSOA_CODE, "OA": ILA_OA_CODE}
-    ILA_CODE = code_dict_map[space_level]
-
-    if space_level == 'LAD': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS002-Legal-Partnership-Status-2021-ltla-ONS.csv"
-        var_col_name = 'Lower tier local authorities Code'
-    if space_level == 'MSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS002-Legal-Partnership-Status-2021-msoa-ONS.csv"
-        var_col_name = 'Middle layer Super Output Areas Code'
-    if space_level == 'LSOA': 
-        var_stat_file = DATA_21_PATH / "statistic-summary" / space_level / "TS002-Legal-Partnership-Status-2021-lsoa-ONS.csv"
-        var_col_name = 'Lower layer Super Output Areas Code'
-    if space_level == 'OA': 
-        print('Error: For Legal Partnership Status attribute, there is no OA level statistics!')
-        return 
-
-    marg_var_all = pd.read_csv(var_stat_file)
-
-    # long-wide form conversion
-    marg_var_inner_london = marg_var_all[marg_var_all[var_col_name].isin(ILA_CODE)]
-    marg_var_wide = marg_var_inner_london.pivot(index=var_col_name, columns='Marital and civil partnership status (12 categories) Code', values='Observation')
-    
-    marg_var_wide['Single'] = marg_var_wide[[1, ]].sum(axis='columns')
-    marg_var_wide['Married/Registered Same-sex'] = marg_var_wide[[2, 3, 4, 5]].sum(axis='columns')
-    marg_var_wide['Separated/Divorced/Widowed'] = marg_var_wide[[6, 7, 8, 9, 10, 11]].sum(axis='columns')
-    marg_var_wide = marg_var_wide[['Single', 'Married/Registered Same-sex', 'Separated/Divorced/Widowed']]
-
-    # add summary row
-    var_sum_row = marg_var_wide.sum(axis=0)
-    marg_var_summary = pd.concat([marg_var_wide, pd.DataFrame([var_sum_row], index=["TOTAL"])])
-    
-    marg_var_summary = marg_var_summary.div(marg_var_summary.sum(axis=1), axis=0)
-    marg_var_summary.rename(columns = {'Single':0, 'Married/Registered Same-sex':1, 'Separated/Divorced/Widowed':2}, inplace=True)
-
-    # rename the index and columns
-    marg_var_summary.index.name = 'GEO_CODE'
-    marg_var_summary.columns.name = None
-    
-    return marg_var_summary
+    return _marg_dist("marital_status", space_level, "Legal Partnership Status")
 
 # marg_leptnershp_dist(space_level='LAD')
 
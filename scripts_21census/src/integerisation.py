@@ -0,0 +1,77 @@
+"""
+Integerisation of fractional synthetic population weights into head counts, for all areas at once.
+
+Weights come as an (areas x person-types) matrix (e.g. BatchIPF.weights) and area totals as a vector
+(e.g. pop_dist.loc[area_codes, 'Total']). Each row is scaled to its total, truncated, and the remaining
+persons are given to the types with the largest residuals (largest remainder) or drawn in proportion to the
+residuals (truncate-replicate-sample, TRS).
+"""
+
+import numpy as np
+
+INTEGERISATION_METHODS = ("largest_remainder", "trs")
+
+
+def integerise(weights, totals, method="largest_remainder", seed=None):
+    """
+    Convert an (areas x person-types) weight matrix into integer head counts.
+
+    Parameters:
+        weights (array-like): Non-negative weights, one row per area. Rows are normalized before scaling.
+        totals (array-like): Population total of each area, e.g. pop_dist['Total'] in area order.
+        method (str): "largest_remainder" (deterministic) or "trs" (truncate-replicate-sample).
+        seed (int or np.random.Generator or None): Random source of the TRS sampling step.
+
+    Returns:
+        np.ndarray: (areas x person-types) count matrix, in the smallest unsigned integer type holding the totals;
+                    each row sums to its area total.
+
+    Raises:
+        ValueError: If the method is unknown, shapes do not match, or an area with a positive total has no weight.
+    """
+    if method not in INTEGERISATION_METHODS:
+        raise ValueError("Unknown integerisation method %s, expected one of %s" % (method, INTEGERISATION_METHODS))
+
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    totals = np.asarray(totals, dtype=np.int64).reshape(-1)
+    if weights.shape[0] != len(totals):
+        raise ValueError("The length of totals must equal to the number of areas (rows) in weights")
+
+    row_sums = weights.sum(axis=1)
+    if ((row_sums <= 0) & (totals > 0)).any():
+        raise ValueError("Areas with a positive total must have positive weights")
+
+    expected = weights * np.divide(totals, row_sums, out=np.zeros(len(totals)), where=row_sums > 0)[:, None]
+    counts = np.floor(expected).astype(np.int64)
+    residual = expected - counts
+    gap = totals - counts.sum(axis=1)       # persons still missing in each area after truncation
+
+    if method == "largest_remainder":
+        keys = -residual
+    else:
+        # weighted sampling without replacement in every row at once: the types with the smallest
+        # Exp(1) / residual keys are a sample drawn with probability proportional to the residuals
+        rng = np.random.default_rng(seed)
+        keys = np.divide(rng.exponential(size=residual.shape), residual,
+                         out=np.full(residual.shape, np.inf), where=residual > 0)
+
+    order = np.argsort(keys, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(order.shape[1])[None, :], axis=1)
+    counts += ranks < gap[:, None]
+
+    return counts.astype(np.min_scalar_type(max(int(totals.max(initial=0)), 1)))
+
+
+def expand_counts(counts):
+    """
+    Unfold a count matrix into one entry per synthetic person.
+
+    Returns:
+        tuple: (area_positions, type_positions), integer arrays with one element per person, ordered by area
+               then person-type (the same order as repeating each area's records by its counts).
+    """
+    counts = np.asarray(counts)
+    area_positions, type_positions = np.nonzero(counts)
+    repeats = counts[area_positions, type_positions].astype(np.int64)
+    return np.repeat(area_positions, repeats), np.repeat(type_positions, repeats)
@@ -4,10 +4,12 @@ This script contains custom functions used to show the maps
 """
 
 # Display Synthetic Population Map
+from pathlib import Path
 import geopandas as gpd
 import folium
 from src.cases import VAR_CODE_CENSUS_2021_SIMPLIFIED
 from src.config import RES_SYN_POP_PATH, RES_MAP_PATH
+from src.columnar_store import read_store
 
 # Define Helper functions
 # Input
@@ -39,15 +41,22 @@ def show_syn_population_map(
     Supports downsampling to reduce clutter.
 
     Parameters:
-        gpkg_name (str): Name of the synthetic population gpkg file with suffix(.gpkg), containing point data.
+        gpkg_name (str): Name of the synthetic population gpkg file with suffix(.gpkg), containing point data,
+                         or of its columnar store folder (no suffix), of which only the shown columns are read.
         sample_rate (float): Proportion of population points to display (e.g., 0.05 = 5%).
         map_location (list): Initial center of the map [latitude, longitude]. 
                              If None, the center is auto-calculated from data.
         zoom_start (int): Initial zoom level of the map.
         save_path (str): Output HTML file name to save the interactive map.
     """
-    # Load the shapefile using geopandas
-    gdf = gpd.read_file(RES_SYN_POP_PATH / gpkg_name, layer='syn_pop')
+    # ori_name_dic = {'age':'age', 'sex':'sex', 'ethnic_gro':'ethnic_group', 'economic_a':'economic_activity', 'number_of_':'number_of_cars_and_vans', 'marital_st':'marital_status', }
+    ori_name_list = ['age', 'sex', 'ethnic_group', 'economic_activity', 'number_of_cars_and_vans', 'marital_status']
+
+    # Load the columnar store, or the gpkg file using geopandas
+    if (RES_SYN_POP_PATH / gpkg_name).is_dir():
+        gdf = read_store(RES_SYN_POP_PATH / gpkg_name, columns=ori_name_list + ['geometry'])
+    else:
+        gdf = gpd.read_file(RES_SYN_POP_PATH / gpkg_name, layer='syn_pop')
     gdf = gdf.to_crs(epsg=4326)
 
     popup_attrs_show_dict = {
@@ -58,8 +67,6 @@ def show_syn_population_map(
         'number_of_cars_and_vans': 'Number of Cars/Vans', 
         'marital_status': 'Martial Status',
     }
-    # ori_name_dic = {'age':'age', 'sex':'sex', 'ethnic_gro':'ethnic_group', 'economic_a':'economic_activity', 'number_of_':'number_of_cars_and_vans', 'marital_st':'marital_status', }
-    ori_name_list = ['age', 'sex', 'ethnic_group', 'economic_activity', 'number_of_cars_and_vans', 'marital_status']
 
     # Filter for point geometries only (skip lines or polygons if any)
     gdf = gdf[gdf.geometry.type == 'Point']
@@ -163,14 +170,20 @@ def show_syn_orders_map(
     Visualize point-based synthetic customer data on an interactive Folium map.
 
     Parameters:
-        shp_path (str): Path to the input shapefile or GeoPackage containing point data.
+        shp_path (str): Path to the input shapefile or GeoPackage containing point data, or to the order
+                        columnar store folder, of which only the shown columns are read.
         sample_rate (float): Fraction of points to display (e.g., 0.05 = 5% sample).
         map_location (list): Initial center of the map [latitude, longitude]. Auto-calculated if None.
         zoom_start (int): Initial zoom level of the map.
         save_path (str or Path): Path to save the output HTML map.
     """
     # Load spatial data
-    gdf = gpd.read_file(shp_path)
+    if Path(shp_path).is_dir():
+        gdf = read_store(shp_path, columns=['Customer_ID', 'Order_ID', 'Area_Code', 'Order_Category', 'geometry'],
+                         partition_column='Area_Code')
+        gdf = gdf.rename(columns={'Area_Code': 'area_code', 'Order_Category': 'cate_sample'})
+    else:
+        gdf = gpd.read_file(shp_path)
     gdf = gdf.to_crs(epsg=4326)  # Convert to WGS84 (lat/lon)
 
     # Keep only Point geometries
@@ -0,0 +1,220 @@
+"""
+Process-pool driver for per-area population synthesis, for synthesizers that cannot be batched
+(SA, custom constraint sets, mixed max_iter ...), and a multi-chain (parallel tempering) SA.
+
+The base population is shipped to each worker process once, through the pool initializer;
+each task only carries the area's constraints and settings.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import math
+import random
+import numpy as np
+from tqdm import tqdm
+
+from .basics import Population, Constraints
+from .synthesizer import IPF, SA
+
+# base population of the current worker process, set by _init_worker
+_worker_base_population = None
+# SA instance and encoded base records of the current tempering worker, set by _init_tempering_worker
+_worker_annealer = None
+_worker_record_codes = None
+
+
+def _init_worker(base_population):
+    global _worker_base_population
+    _worker_base_population = base_population
+
+
+def _synthesize_area(area_code, constraints, synthesizer_cls, synthesizer_kwargs, synthesize_kwargs, seed_seq,
+                     base_population=None):
+    """Run one area in the current process; errors are returned, not raised, so one area cannot stop the run"""
+    if base_population is None:
+        base_population = _worker_base_population
+
+    # the seed depends on the area only, never on the worker that happens to run it
+    seed = int(seed_seq.generate_state(1)[0])
+    random.seed(seed)
+    np.random.seed(seed)
+
+    try:
+        syn = synthesizer_cls(base_population, constraints, **synthesizer_kwargs)
+        syn_pop = syn.synthesize(**synthesize_kwargs)
+        return area_code, syn_pop.records["weights"], syn.abs_error(), None
+    except Exception as e:
+        return area_code, None, None, "%s: %s" % (type(e).__name__, e)
+
+
+def iter_synthesize_areas(base_population: Population, area_constraints: dict, synthesizer_cls=IPF,
+                          synthesizer_kwargs=None, synthesize_kwargs=None, area_synthesize_kwargs=None,
+                          max_workers=None, seed=100):
+    """
+    Synthesize every area in a process pool and yield the results as they complete.
+
+    Parameters:
+        base_population (Population): Base population shared by all areas, sent once to each worker.
+        area_constraints (dict): Maps area code to its Constraints.
+        synthesizer_cls (type): Synthesizer subclass, e.g. IPF or SA.
+        synthesizer_kwargs (dict): Extra constructor arguments, e.g. {"synthesis_size": 300} for SA.
+        synthesize_kwargs (dict): Arguments of synthesize() shared by all areas, e.g. {"max_iter": 1000}.
+        area_synthesize_kwargs (dict): Maps area code to synthesize() arguments overriding the shared ones.
+        max_workers (int or None): Number of worker processes; 1 runs in the current process.
+        seed (int): Root seed; each area gets its own stream derived from it and the area's position.
+
+    Yields:
+        tuple: (area_code, weights, abs_error, failure). weights is the weights column of the area's
+               synthetic population (indexed like its records); on failure weights and abs_error are None
+               and failure holds the error message.
+    """
+    synthesizer_kwargs = synthesizer_kwargs or {}
+    synthesize_kwargs = synthesize_kwargs or {}
+    area_synthesize_kwargs = area_synthesize_kwargs or {}
+    area_seeds = np.random.SeedSequence(seed).spawn(len(area_constraints))
+
+    tasks = [(area_code, constraints, synthesizer_cls, synthesizer_kwargs,
+              {**synthesize_kwargs, **area_synthesize_kwargs.get(area_code, {})}, area_seed)
+             for (area_code, constraints), area_seed in zip(area_constraints.items(), area_seeds)]
+
+    if max_workers == 1:
+        for task in tasks:
+            yield _synthesize_area(*task, base_population=base_population)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(base_population,)) as executor:
+        futures = [executor.submit(_synthesize_area, *task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def synthesize_areas(base_population: Population, area_constraints: dict, synthesizer_cls=IPF,
+                     synthesizer_kwargs=None, synthesize_kwargs=None, area_synthesize_kwargs=None,
+                     max_workers=None, seed=100, show_progress=True):
+    """
+    Synthesize every area in a process pool and collect the results, in the order of area_constraints.
+
+    Takes the same parameters as iter_synthesize_areas.
+
+    Returns:
+        tuple: (weights, errors, failures), dictionaries keyed by area code. Failed areas only appear
+               in failures, mapped to their error message.
+    """
+    weights, errors, failures = {}, {}, {}
+    results = iter_synthesize_areas(base_population, area_constraints, synthesizer_cls,
+                                    synthesizer_kwargs=synthesizer_kwargs,
+                                    synthesize_kwargs=synthesize_kwargs,
+                                    area_synthesize_kwargs=area_synthesize_kwargs,
+                                    max_workers=max_workers, seed=seed)
+
+    for area_code, area_weights, area_error, failure in tqdm(results, desc='Synthesizing Areas',
+                                                             total=len(area_constraints), disable=not show_progress):
+        if failure is not None:
+            tqdm.write(f"[Error] Area {area_code} failed due to error: {failure}")
+            failures[area_code] = failure
+        else:
+            weights[area_code] = area_weights
+            errors[area_code] = area_error
+
+    order = {area_code: i for i, area_code in enumerate(area_constraints)}
+    weights = dict(sorted(weights.items(), key=lambda item: order[item[0]]))
+    errors = dict(sorted(errors.items(), key=lambda item: order[item[0]]))
+    return weights, errors, failures
+
+
+def _init_tempering_worker(base_population, constraints, synthesis_size):
+    global _worker_annealer, _worker_record_codes
+    _worker_annealer = SA(base_population, constraints, synthesis_size)
+    _worker_record_codes = _worker_annealer._encode_base()
+
+
+def _run_replica(sample_index, temperature, n_steps, stop_threshold, rng_state):
+    """Advance one replica by n_steps swaps at a fixed temperature, in the current process"""
+    rng = random.Random()
+    rng.setstate(rng_state)
+    state = _worker_annealer._sample_state(sample_index)
+    current_error, best_index, best_error, _ = _worker_annealer._anneal(state, sample_index, _worker_record_codes,
+                                                                        n_steps, temperature, 1, stop_threshold, rng)
+    return sample_index, current_error, best_index, best_error, rng.getstate()
+
+
+class ParallelTemperingSA(SA):
+    """
+    Multi-chain simulated annealing (parallel tempering), a drop-in replacement for SA.
+
+    n_replicas chains run at fixed temperatures spaced geometrically from init_temperature down to
+    final_temperature, each in a worker process with its own deterministic random stream. Every swap_interval
+    iterations, neighbouring chains exchange their states with the Metropolis swap probability, so good states
+    found by hot chains sink to the cold ones. The best state of all chains is returned.
+    """
+
+    def __init__(self, base_population: Population, constraints: Constraints, synthesis_size, n_replicas=4,
+                 swap_interval=10000, max_workers=None, seed=100):
+        super(ParallelTemperingSA, self).__init__(base_population, constraints, synthesis_size)
+        self.n_replicas = n_replicas
+        self.swap_interval = swap_interval
+        self.max_workers = max_workers
+        self.seed = seed
+        self.swap_acceptance = None     # accepted / attempted swaps of the last run
+        self.replica_errors = None      # best error reached by each replica in the last run
+
+    def synthesize(self, max_iter=100, init_temperature=100, stop_threshold=0.01, synthesis_size=None,
+                   final_temperature=1e-6):
+        """Run every replica for max_iter iterations (in rounds of swap_interval) and keep the best state"""
+        if synthesis_size is not None:
+            self.synthesis_size = synthesis_size
+
+        temperatures = np.geomspace(init_temperature, final_temperature, self.n_replicas)
+        replica_seeds = np.random.SeedSequence(self.seed).spawn(self.n_replicas + 1)
+        swap_rng = random.Random(int(replica_seeds[-1].generate_state(1)[0]))
+
+        n_records = len(self.base_population.records)
+        samples, rng_states = [], []
+        for seed_seq in replica_seeds[:-1]:
+            samples.append(np.random.default_rng(seed_seq).choice(n_records, self.synthesis_size, replace=False))
+            rng_states.append(random.Random(int(seed_seq.generate_state(1)[0])).getstate())
+        errors = [self._sample_state(sample).abs_error() for sample in samples]
+        best_errors = list(errors)
+        best_indices = [sample.copy() for sample in samples]
+        swaps_accepted, swaps_attempted = 0, 0
+
+        initargs = (self.base_population, self.constraints, self.synthesis_size)
+        if self.max_workers == 1:
+            _init_tempering_worker(*initargs)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_tempering_worker,
+                                           initargs=initargs)
+        try:
+            done_iter = 0
+            while done_iter < max_iter and min(best_errors) > stop_threshold:
+                n_steps = min(self.swap_interval, max_iter - done_iter)
+                tasks = [(samples[k], temperatures[k], n_steps, stop_threshold, rng_states[k])
+                         for k in range(self.n_replicas)]
+                if executor is None:
+                    results = [_run_replica(*task) for task in tasks]
+                else:
+                    results = list(executor.map(_run_replica, *zip(*tasks)))
+
+                for k, (sample, error, best_index, best_error, rng_state) in enumerate(results):
+                    samples[k], errors[k], rng_states[k] = sample, error, rng_state
+                    if best_error < best_errors[k]:
+                        best_errors[k], best_indices[k] = best_error, best_index
+                done_iter += n_steps
+
+                # exchange states between neighbouring temperatures, alternating even and odd pairs
+                for k in range(done_iter // self.swap_interval % 2, self.n_replicas - 1, 2):
+                    swaps_attempted += 1
+                    exponent = (errors[k] - errors[k + 1]) * (1 / temperatures[k] - 1 / temperatures[k + 1])
+                    if exponent >= 0 or math.exp(exponent) >= swap_rng.random():
+                        samples[k], samples[k + 1] = samples[k + 1], samples[k]
+                        errors[k], errors[k + 1] = errors[k + 1], errors[k]
+                        swaps_accepted += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.replica_errors = best_errors
+        self.swap_acceptance = swaps_accepted / swaps_attempted if swaps_attempted else None
+        self._set_synthetic_population(best_indices[int(np.argmin(best_errors))])
+        return self.synthetic_population
@@ -1,13 +1,119 @@
-from .basics import Population, Constraints
+from .basics import Demographics, Population, ArrayPopulation, Constraints, encode_codes
+from scipy.optimize import linprog
+import numpy as np
+import math
 import random
 
 
+class MarginalState:
+    """Per-variable category totals of a weighted population, kept up to date as weights or records change
+
+    Category codes are held as integer arrays (positions in the constraints' categorizing) and weights as a
+    float array. Totals are refreshed lazily with np.bincount and patched in place on small changes, so the
+    absolute error against the constraints costs O(categories) once they are current.
+    """
+
+    def __init__(self, constraints: Constraints, population):
+        self.variables = constraints.variables
+        if isinstance(population, ArrayPopulation):
+            self.codes = [self._array_codes(population, var, list(constraints.var_code_cate[var]))
+                          for var in self.variables]
+            self.weights = np.array(population.weights, dtype=float)
+        else:
+            self.codes = [encode_codes(population.records[var], list(constraints.var_code_cate[var]))
+                          for var in self.variables]
+            self.weights = population.records["weights"].to_numpy(dtype=float, copy=True)
+        self.targets = [np.array(constraints.marginals()[var]) for var in self.variables]
+        self._positions = [{code: i for i, code in enumerate(constraints.var_code_cate[var])}
+                           for var in self.variables]
+        self._totals = [None] * len(self.variables)
+
+    @staticmethod
+    def _array_codes(population, var, categories):
+        """Positions of an ArrayPopulation variable in the constraints' categorizing"""
+        population_categories = list(population.demographics.var_code_cate[var])
+        positions = population.codes[var].astype(np.intp)
+        if population_categories == categories:
+            return positions
+        return encode_codes(np.asarray(population_categories)[positions], categories)
+
+    def totals(self, j):
+        """Weight total of every category of the j-th variable"""
+        if self._totals[j] is None:
+            self._totals[j] = np.bincount(self.codes[j], weights=self.weights, minlength=len(self.targets[j]))
+        return self._totals[j]
+
+    def abs_error(self):
+        """Absolute error against the constraints, O(categories) when the totals are current"""
+        return sum(np.abs(self.totals(j) - self.targets[j]).sum() for j in range(len(self.variables)))
+
+    def set_weights(self, weights):
+        self.weights = np.array(weights, dtype=float)
+        self._totals = [None] * len(self.variables)
+
+    def normalize_weights(self, total_weight=1):
+        """Rescale weights to sum to total_weight; current totals are rescaled, not recomputed"""
+        factor = total_weight / self.weights.sum()
+        self.weights *= factor
+        self._totals = [totals * factor if totals is not None else None for totals in self._totals]
+
+    def rake(self, j):
+        """Scale weights so that the j-th variable matches its constraint (one IPF step)"""
+        totals = self.totals(j)
+        scalars = np.divide(self.targets[j], totals, out=np.zeros_like(totals), where=totals >= 1e-6)
+        self.weights *= scalars[self.codes[j]]
+        self._totals = [None] * len(self.variables)
+
+    def update_weights(self, index, weights):
+        """Set the weights of some records, patching the totals in O(changed x variables)"""
+        index = np.atleast_1d(index)
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), index.shape)
+        delta = weights - self.weights[index]
+        for j, totals in enumerate(self._totals):
+            if totals is not None:
+                np.add.at(totals, self.codes[j][index], delta)
+        self.weights[index] = weights
+
+    def encode_record(self, record):
+        """Category positions of one record (a mapping from variable to code)"""
+        return tuple(positions[record[var]] for var, positions in zip(self.variables, self._positions))
+
+    def replace_delta(self, i, record_codes, weight=None):
+        """Change of the absolute error if the i-th record were replaced, without applying it: O(variables)"""
+        old_weight = self.weights[i]
+        new_weight = old_weight if weight is None else weight
+        delta = 0.0
+        for j, new_code in enumerate(record_codes):
+            totals, target = self.totals(j), self.targets[j]
+            old_code = self.codes[j][i]
+            if old_code == new_code:
+                before = totals[old_code]
+                delta += abs(before - old_weight + new_weight - target[old_code]) - abs(before - target[old_code])
+            else:
+                delta += (abs(totals[old_code] - old_weight - target[old_code]) - abs(totals[old_code] - target[old_code])
+                          + abs(totals[new_code] + new_weight - target[new_code]) - abs(totals[new_code] - target[new_code]))
+        return delta
+
+    def replace_record(self, i, record_codes, weight=None):
+        """Replace the i-th record (and optionally its weight), patching the totals in O(variables)"""
+        old_weight = self.weights[i]
+        new_weight = old_weight if weight is None else weight
+        for j, new_code in enumerate(record_codes):
+            totals = self._totals[j]
+            if totals is not None:
+                totals[self.codes[j][i]] -= old_weight
+                totals[new_code] += new_weight
+            self.codes[j][i] = new_code
+        self.weights[i] = new_weight
+
+
 class Synthesizer:
 
     def __init__(self, base_population: Population, constraints: Constraints):
         self.base_population = base_population
         self.constraints = constraints
         self.synthetic_population = None
+        self.marginal_state = None      # MarginalState of the synthetic population, set by synthesize
 
     def abs_error(self, synthetic_population=None):
         """Calculate absolute error of a synthetic population"""
@@ -15,16 +121,11 @@ class Synthesizer:
             if self.synthetic_population is None:
                 synthetic_population = self.base_population
             else:
+                if self.marginal_state is not None:
+                    return self.marginal_state.abs_error()
                 synthetic_population = self.synthetic_population
 
-        error = 0
-        for var in self.constraints.variables:
-            dist_by_code = self.constraints.var_marg_dist[var]
-            weights_by_code = synthetic_population.records.groupby(var)["weights"].sum()
-            for cate_code in dist_by_code:
-                error += abs(weights_by_code[cate_code] - dist_by_code[cate_code])
-
-        return error
+        return MarginalState(self.constraints, synthetic_population).abs_error()
 
     def describe_results(self):
         print("Finial absolute error: ", self.abs_error())
@@ -34,10 +135,19 @@ class Synthesizer:
 
 
 class IPF(Synthesizer):
-    """Synthesis based on Iterative Proportional Fitting - Deterministic Method"""
+    """Synthesis based on Iterative Proportional Fitting - Deterministic Method
 
-    def __init__(self, base_population: Population, constraints: Constraints):
+    backend="numpy" keeps category codes as integer arrays and weights as a float array, and computes
+    marginals with np.bincount; backend="pandas" is the original row-wise implementation.
+    """
+
+    backends = ("numpy", "pandas")
+
+    def __init__(self, base_population: Population, constraints: Constraints, backend="numpy"):
         super(IPF, self).__init__(base_population, constraints)
+        if backend not in self.backends:
+            raise ValueError("Unknown IPF backend %s, expected one of %s" % (backend, self.backends))
+        self.backend = backend
 
     def synthesize(self, max_iter=50, stop_threshold=0.01):
 
@@ -45,6 +155,15 @@ class IPF(Synthesizer):
         self.synthetic_population = Population(self.base_population.demographics,
                                                self.base_population.records,
                                                weights=self.base_population.records["weights"])
+        self.marginal_state = None
+        if self.backend == "numpy":
+            self._synthesize_numpy(max_iter, stop_threshold)
+        else:
+            self._synthesize_pandas(max_iter, stop_threshold)
+
+        return self.synthetic_population
+
+    def _synthesize_pandas(self, max_iter, stop_threshold):
         # IPF procedure
         for _ in range(max_iter):
 
@@ -54,64 +173,389 @@ class IPF(Synthesizer):
                 new_weights = self.synthetic_population.records.apply(
                     lambda row: row["weights"] * dist_by_code[row[var]] / weights_by_code[row[var]] if weights_by_code[row[var]] >= 1e-6 else 0,
                     axis=1)
-                self.synthetic_population.records["weights"] = new_weights
+                self.synthetic_population.set_weights(new_weights)
 
             self.synthetic_population.normalize_weights()
 
             if self.abs_error() <= stop_threshold:
                 break
 
+    def _synthesize_numpy(self, max_iter, stop_threshold):
+        state = MarginalState(self.constraints, self.synthetic_population)
+
+        # IPF procedure, same update rule as the pandas backend: categories with (near) zero weight are zeroed out
+        for _ in range(max_iter):
+
+            for j in range(len(state.variables)):
+                state.rake(j)
+
+            state.normalize_weights()
+
+            if state.abs_error() <= stop_threshold:
+                break
+
+        self.synthetic_population.set_weights(state.weights)
+        self.marginal_state = state
+
+
+class TensorIPF(Synthesizer):
+    """Synthesis based on IPF over the full joint type space, held as an N-dimensional array
+
+    The joint distribution has one axis per constraint variable (shape Constraints.shape) and is seeded from the
+    base population records, plus an optional prior (a scalar pseudo-weight or an array of that shape) so that
+    person-types missing from the microdata can still be synthesized. Marginals are fitted by axis-wise rescaling
+    (np.einsum and broadcast reshapes). sparse=True only keeps the cells of the seed that hold records, for type
+    spaces too large to hold densely: the dense joint is never allocated and joint stays None.
+    """
+
+    def __init__(self, base_population: Population, constraints: Constraints, prior=None, sparse=False):
+        super(TensorIPF, self).__init__(base_population, constraints)
+        if sparse and prior is not None:
+            raise ValueError("A prior gives weight to every cell of the joint, so it cannot be used with sparse=True")
+        self.prior = prior
+        self.sparse = sparse
+        self.joint = None
+
+    def _record_cells(self):
+        """Flat joint cell of every base population record, and the record weights"""
+        records = self.base_population.records
+        codes = [encode_codes(records[var], list(self.constraints.var_code_cate[var]))
+                 for var in self.constraints.variables]
+        return np.ravel_multi_index(codes, self.constraints.shape), records["weights"].to_numpy(dtype=float)
+
+    def seed_cells(self):
+        """Sorted flat cells holding base population records, and their summed weights, without the dense joint"""
+        cells, weights = self._record_cells()
+        cells, inverse = np.unique(cells, return_inverse=True)
+        return cells, np.bincount(inverse, weights=weights, minlength=len(cells))
+
+    def seed_joint(self):
+        """Dense joint distribution of the base population records (plus prior) over the constraint variables"""
+        shape = self.constraints.shape
+        cells, weights = self._record_cells()
+        joint = np.bincount(cells, weights=weights, minlength=int(np.prod(shape))).reshape(shape)
+        if self.prior is not None:
+            joint = joint + np.broadcast_to(np.asarray(self.prior, dtype=float), shape)
+        return joint
+
+    def synthesize(self, max_iter=50, stop_threshold=0.01):
+        if self.sparse:
+            cells, weights = self.seed_cells()
+            cells, weights = cells[weights != 0], weights[weights != 0]
+            state = MarginalState(self.constraints, self._cells_population(cells, weights))
+            for _ in range(max_iter):
+                for j in range(len(state.variables)):
+                    state.rake(j)
+                state.normalize_weights()
+                if state.abs_error() <= stop_threshold:
+                    break
+            fitted = np.flatnonzero(state.weights)
+            self.synthetic_population = self._cells_population(cells[fitted], state.weights[fitted])
+
+        else:
+            joint = self.seed_joint()
+            axes = list(range(joint.ndim))
+            targets = [np.array([self.constraints.var_marg_dist[var][code] for code in self.constraints.var_code_cate[var]],
+                                dtype=float) for var in self.constraints.variables]
+            for _ in range(max_iter):
+                for j, target in enumerate(targets):
+                    weights_by_code = np.einsum(joint, axes, [j])
+                    scalars = np.divide(target, weights_by_code, out=np.zeros_like(target),
+                                        where=weights_by_code >= 1e-6)
+                    joint *= scalars.reshape([-1 if axis == j else 1 for axis in axes])
+
+                joint /= joint.sum()
+
+                error = sum(np.abs(np.einsum(joint, axes, [j]) - target).sum() for j, target in enumerate(targets))
+                if error <= stop_threshold:
+                    break
+
+            self.joint = joint
+            cells = np.flatnonzero(joint)
+            self.synthetic_population = self._cells_population(cells, joint.flat[cells])
+
+        self.marginal_state = MarginalState(self.constraints, self.synthetic_population)
         return self.synthetic_population
 
+    def _cells_population(self, cells, weights):
+        """Aggregate-form Population with one record per given (flat) cell of the joint distribution"""
+        positions = np.unravel_index(cells, self.constraints.shape)
+        records = {var: np.array(list(self.constraints.var_code_cate[var]))[pos]
+                   for var, pos in zip(self.constraints.variables, positions)}
+        return Population(Demographics(self.constraints.var_code_cate), records, weights=weights)
+
+
+class Raking(Synthesizer):
+    """Synthesis based on generalized raking - maximum entropy calibration, deterministic method
+
+    Finds the weights closest to the base weights in Kullback-Leibler divergence that meet every constraint, by
+    damped Newton iterations on one Lagrange multiplier per category (w = d * exp(A' lambda)). Converges in tens
+    of iterations where IPF needs hundreds.
+
+    Before iterating, a linear program finds the smallest absolute error any non-negative weights on the base
+    person-types can reach (the infeasibility) and the marginals reaching it. Infeasible constraints are replaced
+    by these nearest reachable marginals, so the Newton iterations always solve a consistent problem instead of
+    running to max_iter.
+    """
+
+    def __init__(self, base_population: Population, constraints: Constraints):
+        super(Raking, self).__init__(base_population, constraints)
+        self.multipliers = None
+        self.infeasibility = None
+        self.reachable_targets = None
+        self.n_iter = None
+
+    def synthesize(self, max_iter=50, stop_threshold=0.01):
+        state = MarginalState(self.constraints, self.base_population)
+        # one row per (variable, category): the category indicator of every record
+        design = np.vstack([np.eye(len(target))[codes].T for codes, target in zip(state.codes, state.targets)])
+        targets = np.concatenate(state.targets)
+        base_weights = state.weights.copy()
+
+        self.infeasibility, self.reachable_targets = self._nearest_reachable(design, targets)
+        if self.infeasibility > stop_threshold:
+            targets = self.reachable_targets
+
+        def dual_objective(lam):
+            return base_weights @ np.exp(np.minimum(design.T @ lam, 700)) - lam @ targets
+
+        multipliers = np.zeros(len(targets))
+        best_multipliers, best_error, stalled = multipliers, np.inf, 0
+        self.n_iter = 0
+        for _ in range(max_iter):
+            weights = base_weights * np.exp(np.minimum(design.T @ multipliers, 700))
+            error = np.abs(design @ weights - targets).sum()
+            stalled = 0 if error < best_error * (1 - 1e-3) else stalled + 1
+            if error < best_error:
+                best_multipliers, best_error = multipliers, error
+            # reachable targets may lie on the boundary (some weights tending to zero): stop once progress stalls
+            if error <= stop_threshold or stalled >= 5:
+                break
+
+            # Newton step on the dual; the Hessian is singular (each variable's categories share the total),
+            # so the step is the least squares solution
+            gradient = design @ weights - targets
+            hessian = (design * weights) @ design.T
+            step = -np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+
+            # backtracking line search on the (convex) dual objective
+            objective, step_size = dual_objective(multipliers), 1.0
+            while (step_size > 1e-10 and
+                   dual_objective(multipliers + step_size * step) > objective + 1e-4 * step_size * (gradient @ step)):
+                step_size /= 2
+            multipliers = multipliers + step_size * step
+            self.n_iter += 1
+
+        state.set_weights(base_weights * np.exp(np.minimum(design.T @ best_multipliers, 700)))
+        self.multipliers = best_multipliers
+        self.marginal_state = state
+        self.synthetic_population = Population(self.base_population.demographics,
+                                               self.base_population.records,
+                                               weights=state.weights)
+        return self.synthetic_population
+
+    def _nearest_reachable(self, design, targets):
+        """Smallest absolute error reachable by non-negative weights on the person-types with base weight,
+        and the marginals reaching it"""
+        support = design[:, self.base_population.records["weights"].to_numpy() > 0]
+        n_types, n_cates = support.shape[1], len(targets)
+        # min sum(s+ + s-)  s.t.  support w + s+ - s- = targets,  w, s+, s- >= 0
+        result = linprog(np.concatenate([np.zeros(n_types), np.ones(2 * n_cates)]),
+                         A_eq=np.hstack([support, np.eye(n_cates), -np.eye(n_cates)]), b_eq=targets,
+                         bounds=(0, None), method="highs")
+        if not result.success:
+            raise ValueError("Could not bound the constraint infeasibility: %s" % result.message)
+        return max(result.fun, 0.0), support @ result.x[:n_types]
+
+    def describe_results(self):
+        print("Newton iterations: ", self.n_iter)
+        print("Constraint infeasibility (least reachable absolute error): ", self.infeasibility)
+        super(Raking, self).describe_results()
+
 
 class SA(Synthesizer):
-    """Synthesis based on Simulated Annealing - stochastic method"""
+    """Synthesis based on Simulated Annealing - stochastic method
+
+    The synthetic population is kept as an index array over the base population records; each move swaps one
+    synthetic record for a random base record and is scored in O(variables) on the marginal totals.
+    The temperature cools geometrically from init_temperature to final_temperature over max_iter iterations.
+    """
 
     def __init__(self, base_population: Population, constraints: Constraints, synthesis_size):
         super(SA, self).__init__(base_population, constraints)
         self.synthesis_size = synthesis_size
+        self.sample_index = None    # positions of the synthetic records in the base population
 
-    def synthesize(self, max_iter=100, init_temperature=100, stop_threshold=0.01, synthesis_size=None):
+    def synthesize(self, max_iter=100, init_temperature=100, stop_threshold=0.01, synthesis_size=None,
+                   final_temperature=1e-6):
         # initialize synthetic population
         if synthesis_size is not None:
             self.synthesis_size = synthesis_size
 
+        record_codes = self._encode_base()
+        sample_index = np.random.choice(len(record_codes), self.synthesis_size, replace=False)
+        state = self._sample_state(sample_index)
+
         # simulated annealing procedure
-        current_pop = Population(self.base_population.demographics,
-                                 self.base_population.records.sample(self.synthesis_size))
-
-        best_pop = current_pop
-        best_error = self.abs_error(best_pop)
-
-        for iter_num in range(max_iter):
-            current_error = self.abs_error(current_pop)
-            new_pop = self.gen_new_syn_pop(current_pop)
-            new_error = self.abs_error(new_pop)
-            temperature = (iter_num / max_iter) * init_temperature
-
-            if new_error < current_error:
-                current_pop = new_pop
-                if new_error < best_error:
-                    best_pop = new_pop
-                    best_error = new_error
-            else:
-                if pow(2.71828, (current_error - new_error) * temperature) >= random.random():
-                    current_pop = new_pop
+        cooling = (final_temperature / init_temperature) ** (1 / max(max_iter, 1))
+        _, best_index, _, _ = self._anneal(state, sample_index, record_codes, max_iter, init_temperature, cooling,
+                                           stop_threshold)
+
+        self._set_synthetic_population(best_index)
+        return self.synthetic_population
+
+    def _encode_base(self):
+        """Category positions of every base record, one tuple per record"""
+        base_records = self.base_population.records
+        base_codes = np.column_stack([encode_codes(base_records[var], list(self.constraints.var_code_cate[var]))
+                                      for var in self.constraints.variables])
+        return [tuple(codes) for codes in base_codes.tolist()]
 
+    def _anneal(self, state, sample_index, record_codes, n_steps, temperature, cooling, stop_threshold, rng=random):
+        """
+        Run up to n_steps Metropolis swaps in place on the sample and its marginal state.
+
+        rng is any object with the random.Random interface (the random module by default).
+
+        Returns:
+            tuple: (current_error, best_index, best_error, temperature) after the last step.
+        """
+        record_weight = 1 / self.synthesis_size
+        current_error = state.abs_error()
+        best_index = sample_index
+        best_error = current_error
+        at_best = True      # best_index is only copied when the walk leaves the best state
+
+        for _ in range(n_steps):
             if best_error <= stop_threshold:
                 break
 
-        self.synthetic_population = best_pop
+            new_record = rng.randrange(len(record_codes))
+            replaced = rng.randrange(self.synthesis_size)
+            new_codes = record_codes[new_record]
+            delta = state.replace_delta(replaced, new_codes, weight=record_weight)
 
-        return self.synthetic_population
+            if delta < 0 or math.exp(-delta / temperature) >= rng.random():
+                if delta >= 0 and at_best:
+                    best_index = sample_index.copy()
+                    at_best = False
+                state.replace_record(replaced, new_codes, weight=record_weight)
+                sample_index[replaced] = new_record
+                current_error += delta
+                if current_error < best_error:
+                    best_error = current_error
+                    at_best = True
+
+            temperature *= cooling
+
+        if at_best:
+            best_index = sample_index.copy()
 
-    def gen_new_syn_pop(self, pop):
-        new_pop = Population(pop.demographics,
-                             pop.records,
-                             weights=pop.records["weights"])
+        return current_error, best_index, best_error, temperature
 
-        new_ind = self.base_population.records.sample(1)
-        new_ind["weights"] = 1 / self.synthesis_size
-        replaced_ind_index = random.randint(0, self.synthesis_size - 1)
-        new_pop.records.iloc[replaced_ind_index] = new_ind
-        return new_pop
+    def _set_synthetic_population(self, sample_index):
+        self.sample_index = sample_index
+        self.marginal_state = self._sample_state(sample_index)
+        self.synthetic_population = Population(self.base_population.demographics,
+                                               self.base_population.records.iloc[sample_index],
+                                               weights=np.full(len(sample_index), 1 / self.synthesis_size))
+
+    def _sample_state(self, sample_index):
+        """MarginalState of the synthetic population given by positions in the base population"""
+        sample = Population(self.base_population.demographics,
+                            self.base_population.records.iloc[sample_index],
+                            weights=np.full(len(sample_index), 1 / self.synthesis_size))
+        return MarginalState(self.constraints, sample)
+
+
+class BatchIPF:
+    """Iterative Proportional Fitting of many areas at once, sharing one (aggregated) base population
+
+    Area weights are held as an (areas x person-types) matrix and fitted against an
+    (areas x variables x categories) constraint tensor, variables following constraint_var_code_cate.
+    Every area follows the same update rule as IPF and stops on its own once its error reaches the threshold.
+    """
+
+    def __init__(self, base_population: Population, constraint_var_code_cate: dict, constraint_tensor,
+                 area_codes=None, weights=None):
+        self.base_population = base_population
+        self.constraint_var_code_cate = constraint_var_code_cate
+        self.constraint_tensor = np.asarray(constraint_tensor, dtype=float)
+        self.variables = tuple(constraint_var_code_cate)
+
+        n_areas = self.constraint_tensor.shape[0]
+        if self.constraint_tensor.shape[1] != len(self.variables):
+            raise ValueError("The constraint tensor has %d variables, but %d are categorized"
+                             % (self.constraint_tensor.shape[1], len(self.variables)))
+        self.area_codes = list(area_codes) if area_codes is not None else list(range(n_areas))
+        if len(self.area_codes) != n_areas:
+            raise ValueError("The length of area_codes must equal to the number of areas in the constraint tensor")
+
+        records = base_population.records
+        self.type_codes = [encode_codes(records[var], list(constraint_var_code_cate[var])) for var in self.variables]
+        if weights is None:
+            weights = np.tile(records["weights"].to_numpy(dtype=float), (n_areas, 1))
+        self.init_weights = np.asarray(weights, dtype=float)
+        if self.init_weights.shape != (n_areas, len(records)):
+            raise ValueError("The weight matrix must be of shape (areas, person-types) = %s" % ((n_areas, len(records)),))
+
+        # one-hot (person-types x categories) matrices turn per-area marginals into one matrix product
+        n_cates = self.constraint_tensor.shape[2]
+        self._indicators = [np.eye(n_cates)[codes] for codes in self.type_codes]
+
+        self.weights = None
+        self.n_iter = None
+        self.converged = None
+
+    def marginals(self, weights=None):
+        """Return the (areas x variables x categories) marginal tensor of a weight matrix"""
+        if weights is None:
+            weights = self.weights if self.weights is not None else self.init_weights
+        return np.stack([weights @ indicator for indicator in self._indicators], axis=1)
+
+    def abs_error(self, weights=None):
+        """Calculate absolute error of every area, as an array"""
+        return np.abs(self.marginals(weights) - self.constraint_tensor).sum(axis=(1, 2))
+
+    def synthesize(self, max_iter=50, stop_threshold=0.01):
+        weights = self.init_weights.copy()
+        n_areas = weights.shape[0]
+        active = np.arange(n_areas)
+        n_iter = np.zeros(n_areas, dtype=int)
+        converged = np.zeros(n_areas, dtype=bool)
+
+        for _ in range(max_iter):
+            if len(active) == 0:
+                break
+
+            area_weights = weights[active]
+            targets = self.constraint_tensor[active]
+            for j, (codes, indicator) in enumerate(zip(self.type_codes, self._indicators)):
+                weights_by_code = area_weights @ indicator
+                scalars = np.divide(targets[:, j], weights_by_code, out=np.zeros_like(weights_by_code),
+                                    where=weights_by_code >= 1e-6)
+                area_weights *= scalars[:, codes]
+
+            area_weights /= area_weights.sum(axis=1, keepdims=True)
+            weights[active] = area_weights
+            n_iter[active] += 1
+
+            errors = np.abs(self.marginals(area_weights) - targets).sum(axis=(1, 2))
+            done = errors <= stop_threshold
+            converged[active[done]] = True
+            active = active[~done]
+
+        self.weights, self.n_iter, self.converged = weights, n_iter, converged
+        return self.weights
+
+    def to_populations(self):
+        """Split the fitted weight matrix into one aggregate-form Population per area"""
+        records = self.base_population.records[list(self.base_population.variables)]
+        return {area_code: Population(self.base_population.demographics, records, weights=self.weights[i])
+                for i, area_code in enumerate(self.area_codes)}
+
+    def describe_results(self):
+        errors = self.abs_error()
+        print("Areas converged: %d/%d" % (self.converged.sum(), len(self.area_codes)))
+        print("Iterations: min %d, max %d" % (self.n_iter.min(), self.n_iter.max()))
+        print("Final absolute error: mean %.6f, max %.6f" % (errors.mean(), errors.max()))
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from src.basics import Demographics, Population
+
+VAR_CODE_CATE = {'sex': {0: 'Female', 1: 'Male'}, 'age': {0: '0-17', 1: '18-64', 2: '65+'}}
+
+
+def make_population():
+    records = pd.DataFrame({'sex': [0, 1, 1, 0], 'age': [0, 1, 2, 1]})
+    return Population(Demographics(VAR_CODE_CATE), records, weights=[0.25, 0.25, 0.25, 0.25])
+
+
+def test_marginal_dist_follows_in_place_weight_write():
+    pop = make_population()
+    assert pop.marginal_dist['sex'] == {'Female': 0.5, 'Male': 0.5}
+
+    pop.records['weights'] = np.array([0.4, 0.1, 0.1, 0.4])
+
+    assert pop.marginal_dist['sex'] == {'Female': 0.8, 'Male': 0.2}
+    assert pop.marginal_dist['age'] == {'0-17': 0.4, '18-64': 0.5, '65+': 0.1}
+    np.testing.assert_allclose(pop.marginals()['sex'], [0.8, 0.2])
+
+
+def test_marginals_follow_in_place_weight_write_before_normalize():
+    pop = make_population()
+    pop.marginals()
+
+    pop.records['weights'] = np.array([3.0, 1.0, 0.0, 0.0])
+    pop.normalize_weights()
+
+    np.testing.assert_allclose(pop.marginals()['sex'], [0.75, 0.25])
+    assert pop.marginal_dist['age'] == {'0-17': 0.75, '18-64': 0.25, '65+': 0.0}
+
+
+def test_marginals_follow_set_weights():
+    pop = make_population()
+    pop.marginals()
+
+    pop.set_weights([0.0, 0.5, 0.5, 0.0])
+
+    np.testing.assert_allclose(pop.marginals()['sex'], [0.0, 1.0])
+
+
+def test_marginals_follow_invalidate_after_element_write():
+    pop = make_population()
+    pop.marginals()
+
+    pop.records.loc[0, 'weights'] = 0.75
+    pop.invalidate_marginals()
+
+    np.testing.assert_allclose(pop.marginals()['sex'], [1.0, 0.5])